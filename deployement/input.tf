@@ -23,6 +23,12 @@ variable "cloudfront-key-pair-id" {
   type = string
 }
 
+variable "mail-image-variants" {
+  type = string
+  default = "0"
+  description = "1 to link the resized covers in the newsletter, once image_backfill.py hosted them for existing series"
+}
+
 data "terraform_remote_state" "aws-common" {
   backend = "s3"
   config = {
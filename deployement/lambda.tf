@@ -31,7 +31,7 @@ data "aws_iam_policy_document" "allow-db-access" {
       "dynamodb:Update*",
       "dynamodb:PutItem"
     ]
-    resources = [aws_dynamodb_table.page-mark-table.arn]
+    resources = [aws_dynamodb_table.page-mark-table.arn, aws_dynamodb_table.page-mark-archive-table.arn]
   }
 }
 
@@ -45,6 +45,16 @@ data "aws_iam_policy_document" "allow-ses-calls" {
   }
 }
 
+# bodies are rendered by the lambda for each group of subscribers and passed as template data
+resource "aws_ses_template" "newsletter" {
+  name = "manga_newsletter"
+  subject = "{{subject}}"
+  html = "{{{html_body}}}"
+  text = "{{{text_body}}}"
+
+  provider = aws.us-east-aws
+}
+
 data "aws_iam_policy_document" "allow-sns-errors-report" {
   version = "2012-10-17"
   statement {
@@ -87,6 +97,8 @@ module "lambda" {
     NEWSLETTER_SENDER	= var.sender-mail
     CLOUD_FRONT_DISTRIBUTION_DOMAIN = aws_cloudfront_distribution.s3_distribution.domain_name
     CLOUD_FRONT_KEY_ID = var.cloudfront-key-pair-id
+    SES_NEWSLETTER_TEMPLATE = aws_ses_template.newsletter.name
+    MAIL_IMAGE_VARIANTS = var.mail-image-variants
   }
 
   dead_letter_target_arn = data.terraform_remote_state.aws-common.outputs.monitoring_sns_us_arn
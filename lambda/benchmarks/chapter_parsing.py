@@ -0,0 +1,141 @@
+"""
+Compares the single pass chapter label parser with the regex by regex parsing it replaced.
+run from the lambda folder: `python -m benchmarks.chapter_parsing`
+"""
+import random
+import re
+import timeit
+from typing import List
+
+import click
+
+from global_types import Chapter, parse_chapter, parse_chapters
+
+_LEGACY_REGEX_VALUES_MAPPING = [
+    (value, re.compile(f'^{keyword} ?(?P<number>[0-9]*)$'))
+    for value, keyword in [
+        (-2000000, 'oneshot'),
+        (-1500000, 'drama cd'),
+        (-1000000, 'extra'),
+        (-1000000, 'extras'),
+        (-1000000, 'omakes'),
+        (-1000000, 'omake'),
+        (-500000, 'special'),
+        (-100000, 'prologue'),
+        (9000000, 'epilogue'),
+    ]
+]
+_LEGACY_UNSUPPORTED_CHARS_REGEX = re.compile(r'[^\w .]')
+_LEGACY_VERSION_REGEX = re.compile('v[ .]*[0-9]+$')
+_LEGACY_END_REGEX = re.compile('end$')
+_LEGACY_SUB_CHAPTER_LETTER = re.compile('^(?P<number>[0-9]+)(?P<letter>[a-z])$')
+
+
+def legacy_chapter_val(chapter: str) -> float:
+    """ former Chapter.get_chapter_val, trying each regex one after the other """
+    try:
+        return float(chapter)
+    except (ValueError, TypeError):
+        pass
+    if not chapter:
+        return float(-9000000)
+    attached_string_chapter = _LEGACY_UNSUPPORTED_CHARS_REGEX.sub('', chapter).lower().strip()
+    attached_string_chapter = _LEGACY_END_REGEX.sub('', attached_string_chapter).strip()
+    attached_string_chapter = _LEGACY_VERSION_REGEX.sub('', attached_string_chapter).strip()
+    for value, regexp in _LEGACY_REGEX_VALUES_MAPPING:
+        matched = regexp.match(attached_string_chapter)
+        if not matched:
+            continue
+        number_string = matched.group('number')
+        if not number_string:
+            return float(value)
+        return float(value + int(number_string))
+    sub_chapter_matched = _LEGACY_SUB_CHAPTER_LETTER.match(attached_string_chapter)
+    if sub_chapter_matched:
+        sub_version = ord(sub_chapter_matched.group('letter')) - ord('a') + 1
+        return int(sub_chapter_matched.group('number')) + sub_version/10
+    try:
+        return float(attached_string_chapter)
+    except (ValueError, TypeError):
+        pass
+    return -1
+
+
+def build_labels(count: int, seed: int) -> List[str]:
+    """ chapter labels looking like the ones found in the release feed """
+    rand = random.Random(seed)
+    templates = [
+        lambda n: str(n),
+        lambda n: f'{n}.{rand.randint(1, 9)}',
+        lambda n: f'{n}{rand.choice("abc")}',
+        lambda n: f'{n} v{rand.randint(2, 3)}',
+        lambda n: f'{n} (end)',
+        lambda n: f'{n}-{n + 2}',
+        lambda n: f'{rand.choice(["Extra", "Omake", "Special", "Oneshot"])} {rand.randint(0, 9)}',
+        lambda n: rand.choice(['Prologue', 'Epilogue', 'Drama CD', 'extras', '']),
+    ]
+    weights = [60, 8, 6, 6, 4, 4, 8, 4]
+    return [rand.choices(templates, weights)[0](rand.randint(1, 2000)) for _ in range(count)]
+
+
+@click.command()
+@click.option('--labels', 'label_count', default=20000, help='Number of chapter labels parsed per run.')
+@click.option('--repeat', default=5, help='Number of timed runs, the best one is reported.')
+@click.option('--seed', default=0, help='Seed of the generated labels.')
+def benchmark(label_count: int, repeat: int, seed: int):
+    """ checks both parsers agree then times them """
+    labels = build_labels(label_count, seed)
+    mismatches = [(label, legacy_chapter_val(label), parse_chapter(label))
+                  for label in set(labels) if legacy_chapter_val(label) != parse_chapter(label)]
+    if mismatches:
+        raise click.ClickException(f'Parsers disagree on {len(mismatches)} labels, for instance {mismatches[:5]}')
+
+    def is_numeric(label: str) -> bool:
+        try:
+            float(label)
+        except ValueError:
+            return False
+        return True
+    # labels going through the regexes, float labels take the same fast path in both parsers
+    text_labels = [label for label in labels if not is_numeric(label)]
+
+    def run_legacy():
+        return [legacy_chapter_val(label) for label in labels]
+
+    def run_legacy_text():
+        return [legacy_chapter_val(label) for label in text_labels]
+
+    def run_single_pass_text():
+        parse_chapter.cache_clear()
+        return [parse_chapter(label) for label in text_labels]
+
+    def run_single_pass():
+        parse_chapter.cache_clear()
+        return [parse_chapter(label) for label in labels]
+
+    def run_batch():
+        parse_chapter.cache_clear()
+        return parse_chapters(labels)
+
+    def run_batch_warm():
+        return parse_chapters(labels)
+
+    def run_sort_chapters():
+        chapters = [Chapter(label) for label in labels]
+        Chapter.prime_sort_keys(chapters)
+        return sorted(chapters, key=Chapter.sort_key, reverse=True)
+
+    click.echo(f'{label_count} labels ({len(text_labels)} non numeric), best of {repeat} runs')
+    for name, run, count in [('legacy regex loop', run_legacy, label_count),
+                             ('single pass', run_single_pass, label_count),
+                             ('legacy, non numeric', run_legacy_text, len(text_labels)),
+                             ('single pass, non numeric', run_single_pass_text, len(text_labels)),
+                             ('batch (cold cache)', run_batch, label_count),
+                             ('batch (warm cache)', run_batch_warm, label_count),
+                             ('prime and sort chapters', run_sort_chapters, label_count)]:
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        click.echo(f'{name:<26}{best * 1000:>10.2f} ms{best / count * 1e6:>10.3f} us/label')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,196 @@
+"""
+Runs main.handle_scheduled_scraping against the stand-ins of benchmarks.fakes with synthetic page marks and releases.
+Reports wall time, time per stage, peak memory and the dynamodb capacity units consumed.
+run from the lambda folder: `python -m benchmarks.end_to_end --series 10 --series 1000 --series 10000`
+"""
+from collections import defaultdict
+from contextlib import contextmanager, redirect_stdout
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Iterator, Callable, Tuple
+
+import click
+
+os.environ.setdefault('AWS_REGION_SCRAPPING', 'us-east-1')
+os.environ.setdefault('CLOUD_FRONT_DISTRIBUTION_DOMAIN', 'cdn.example.com')
+
+import emailing.helper  # noqa: E402
+import img_hosting  # noqa: E402
+import main  # noqa: E402
+import page_marks_db  # noqa: E402
+import release_formating  # noqa: E402
+from global_types import Chapter  # noqa: E402
+from benchmarks.fakes import ReleaseFeed, fake_services, FakeServices  # noqa: E402
+
+
+class StageTimer:
+    """ time spent in the functions called by the handler, grouped by stage, without the time of the nested ones """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = defaultdict(float)
+        self._nested_durations: List[float] = []
+
+    def _time(self, stage: str, call: Callable):
+        start = time.perf_counter()
+        self._nested_durations.append(0.)
+        try:
+            return call()
+        finally:
+            duration = time.perf_counter() - start
+            self.durations[stage] += duration - self._nested_durations.pop()
+            if self._nested_durations:
+                self._nested_durations[-1] += duration
+
+    def wrap(self, stage: str, function: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            return self._time(stage, lambda: function(*args, **kwargs))
+        return timed
+
+    def wrap_iterator(self, stage: str, function: Callable) -> Callable:
+        """ only the time spent producing the items is counted, not the time spent by the consumer """
+        def timed(*args, **kwargs):
+            iterator = iter(function(*args, **kwargs))
+            while True:
+                try:
+                    item = self._time(stage, lambda: next(iterator))
+                except StopIteration:
+                    return
+                yield item
+        return timed
+
+
+# module, attribute, stage name and whether it returns an iterator consumed by the handler
+_TIMED_FUNCTIONS = [
+    (page_marks_db, 'get_release_cursor', 'load cursor', False),
+    (page_marks_db, 'get_cached', 'load page marks', False),
+    (page_marks_db, 'get_page_mark_count', 'load page marks', False),
+    (page_marks_db, 'estimate_table', 'load page marks', False),
+    (page_marks_db, 'get_all', 'load page marks', False),
+    (page_marks_db, 'get_many', 'load page marks', False),
+    (main, 'iter_release_pages', 'fetch releases', True),
+    (main, 'iter_releases', 'fetch releases', True),
+    (release_formating, 'format_new_releases', 'format releases', False),
+    (emailing.helper, 'build_html_body', 'render email', False),
+    (emailing.helper, 'build_txt_body', 'render email', False),
+    (emailing.helper, 'send_newsletter', 'send email', False),
+    (page_marks_db, 'save_modified', 'save page marks', False),
+    (page_marks_db, 'put_release_cursor', 'save cursor', False),
+]
+STAGES = list(dict.fromkeys(stage for _, _, stage, _ in _TIMED_FUNCTIONS))
+
+
+@contextmanager
+def timed_stages(timer: StageTimer) -> Iterator[None]:
+    originals = [(module, attribute, getattr(module, attribute)) for module, attribute, _, _ in _TIMED_FUNCTIONS]
+    for module, attribute, stage, is_iterator in _TIMED_FUNCTIONS:
+        wrapper = timer.wrap_iterator if is_iterator else timer.wrap
+        setattr(module, attribute, wrapper(stage, getattr(module, attribute)))
+    try:
+        yield
+    finally:
+        for module, attribute, original in originals:
+            setattr(module, attribute, original)
+
+
+def seed_page_marks(series: int, history: int) -> List[str]:
+    """ writes series page marks with history chapters each, returns their ids """
+    serie_ids = [str(serie_id) for serie_id in range(1, series + 1)]
+    page_marks_db.batch_put(
+        page_marks_db.PageMark(serie_id=serie_id,
+                               serie_name=f'serie {serie_id}',
+                               chapter_marks=[Chapter(str(chapter)) for chapter in range(history)])
+        for serie_id in serie_ids)
+    return serie_ids
+
+
+@contextmanager
+def signing_key() -> Iterator[None]:
+    """ a throwaway cloudfront key so that image urls are signed as in production """
+    import rsa
+    _, private_key = rsa.newkeys(2048)
+    with tempfile.NamedTemporaryFile(suffix='.key') as key_file:
+        key_file.write(private_key.save_pkcs1())
+        key_file.flush()
+        previous_key_file = img_hosting.CLOUD_FRONT_SECRET_KEY
+        img_hosting.CLOUD_FRONT_SECRET_KEY = key_file.name
+        img_hosting._load_private_key.cache_clear()
+        try:
+            yield
+        finally:
+            img_hosting.CLOUD_FRONT_SECRET_KEY = previous_key_file
+            img_hosting._load_private_key.cache_clear()
+
+
+def run_scenario(series: int, history: int, invocations: int, measure_memory: bool, feed_options: Dict) \
+        -> List[Tuple[float, Dict[str, float], int, FakeServices, float, float]]:
+    """
+    seeds a new table then runs the handler invocations times, the first one being a cold start.
+    returns per invocation the wall time, stage times, peak memory and the services with their capacity units.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        previous_cache_file = page_marks_db.PAGE_MARKS_CACHE_FILE
+        page_marks_db.PAGE_MARKS_CACHE_FILE = os.path.join(cache_dir, 'page_marks.pickle')
+        feed = ReleaseFeed(watched_series_ids=[], history=history, **feed_options)
+        try:
+            with fake_services(feed) as services:
+                feed.watched_series_ids = [int(serie_id) for serie_id in seed_page_marks(series, history)]
+                page_marks_db._cached_page_marks = None  # as after a cold start
+                for _ in range(invocations):
+                    services.dynamodb.meter.reset()
+                    timer = StageTimer()
+                    if measure_memory:
+                        tracemalloc.start()
+                    start = time.perf_counter()
+                    # the handler prints its metrics as embedded metric format lines
+                    with timed_stages(timer), open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                        main.handle_scheduled_scraping(None, None)
+                    wall_time = time.perf_counter() - start
+                    peak_memory = 0
+                    if measure_memory:
+                        peak_memory = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                    results.append((wall_time, dict(timer.durations), peak_memory, services,
+                                    services.dynamodb.meter.read_units, services.dynamodb.meter.write_units))
+        finally:
+            page_marks_db.PAGE_MARKS_CACHE_FILE = previous_cache_file
+    return results
+
+
+@click.command()
+@click.option('--series', 'series_counts', multiple=True, type=int, default=[10, 1000],
+              help='Number of watched series, can be given several times.')
+@click.option('--history', default=100, help='Number of chapters already stored per serie.')
+@click.option('--pages', default=10, help='Number of release pages in the feed.')
+@click.option('--records-per-page', default=40, help='Number of release records per page.')
+@click.option('--pages-per-day', default=3, help='Number of release pages per day of releases.')
+@click.option('--watched-share', default=.2, help='Share of the releases that are for watched series.')
+@click.option('--invocations', default=2, help='Consecutive invocations, the first one is a cold start.')
+@click.option('--memory/--no-memory', 'measure_memory', default=True,
+              help='Traces the peak memory, which slows down the run.')
+@click.option('--seed', default=0, help='Seed of the generated releases.')
+def benchmark(series_counts: List[int], history: int, pages: int, records_per_page: int, pages_per_day: int,
+              watched_share: float, invocations: int, measure_memory: bool, seed: int):
+    """ runs the handler on synthetic data for each number of watched series """
+    feed_options = dict(pages=pages, records_per_page=records_per_page, pages_per_day=pages_per_day,
+                        watched_share=watched_share, seed=seed)
+    with signing_key():
+        for series in series_counts:
+            click.echo(f'{series} series with {history} chapters, {pages} pages of {records_per_page} releases')
+            results = run_scenario(series, history, invocations, measure_memory, feed_options)
+            for invocation, (wall_time, durations, peak_memory, services, read_units, write_units) \
+                    in enumerate(results):
+                click.echo(f'  invocation {invocation + 1} ({"cold" if invocation == 0 else "warm"}): '
+                           f'{wall_time * 1000:.1f} ms'
+                           + (f', peak memory {peak_memory / 2 ** 20:.1f} MiB' if measure_memory else '')
+                           + f', {read_units:g} RCU, {write_units:g} WCU')
+                for stage in STAGES:
+                    click.echo(f'    {stage:<20}{durations.get(stage, 0.) * 1000:>10.1f} ms')
+            click.echo(f'  {services.http.requests} http requests, {len(services.ses.sent)} emails sent '
+                       f'({services.ses.sent_bytes / 1024:.1f} KiB)')
+
+
+if __name__ == '__main__':
+    benchmark()
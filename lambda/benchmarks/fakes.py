@@ -0,0 +1,480 @@
+"""
+In process stand-ins for the services called by the lambda: the release feed over http, dynamodb, ses and s3.
+They keep what is needed by the code of the lambda and count the capacity units dynamodb would consume.
+"""
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+import io
+from itertools import count
+import json
+from math import ceil
+import random
+import re
+import threading
+from typing import Dict, List, Any, Iterator, Union, Sequence
+from unittest import mock
+import urllib.parse
+import zlib
+
+import requests
+
+READ_UNIT_SIZE = 4096
+WRITE_UNIT_SIZE = 1024
+SCAN_PAGE_SIZE = 1024 * 1024  # data read by a scan call before filtering
+
+
+def attribute_size(value: Any) -> int:
+    """ approximate size of an attribute value as counted by dynamodb """
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value)) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + item_size(value)
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(attribute_size(element) + 1 for element in value)
+    return attribute_size(getattr(value, 'value', str(value)))
+
+
+def item_size(item: Dict[str, Any]) -> int:
+    return sum(len(name.encode('utf8')) + attribute_size(value) for name, value in item.items())
+
+
+class CapacityMeter:
+    """ read and write capacity units that dynamodb would have consumed """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.read_units = 0.
+        self.write_units = 0.
+        self.requests = 0
+
+    def read(self, size: int, consistent: bool = False) -> float:
+        units = max(1, ceil(size / READ_UNIT_SIZE)) * (1 if consistent else .5)
+        with self._lock:
+            self.requests += 1
+            self.read_units += units
+        return units
+
+    def write(self, size: int) -> float:
+        units = max(1, ceil(size / WRITE_UNIT_SIZE))
+        with self._lock:
+            self.requests += 1
+            self.write_units += units
+        return units
+
+
+def _project(item: Dict[str, Any], projection: Union[None, str]) -> Dict[str, Any]:
+    if projection is None:
+        return dict(item)
+    names = [name.strip() for name in projection.split(',')]
+    return {name: item[name] for name in names if name in item}
+
+
+class _BatchWriter:
+    def __init__(self, table: 'FakeTable'):
+        self._table = table
+
+    def __enter__(self) -> '_BatchWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def put_item(self, Item: Dict[str, Any]) -> None:
+        self._table.put_item(Item=Item)
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self._table.delete_item(Key=Key)
+
+
+class FakeTable:
+    """ dynamodb table with a single string hash key """
+
+    def __init__(self, name: str, meter: CapacityMeter, hash_key: str = 'serie_id'):
+        self.name = name
+        self.hash_key = hash_key
+        self.meter = meter
+        self.items: Dict[str, Dict[str, Any]] = dict()
+        self._lock = threading.Lock()
+        self.meta = mock.Mock()
+        self.meta.client.describe_table.side_effect = self._describe_table
+
+    def _describe_table(self, TableName: str) -> Dict[str, Any]:
+        return dict(Table=dict(TableName=TableName,
+                               ItemCount=len(self.items),
+                               TableSizeBytes=sum(item_size(item) for item in self.items.values())))
+
+    def _consumed(self, units: float) -> Dict[str, Any]:
+        """ capacity returned to requests made with ReturnConsumedCapacity """
+        return dict(ConsumedCapacity=dict(TableName=self.name, CapacityUnits=units))
+
+    def get_item(self, Key: Dict[str, Any], ConsistentRead: bool = False,
+                 ProjectionExpression: Union[None, str] = None, **_) -> Dict[str, Any]:
+        item = self.items.get(Key[self.hash_key])
+        response = self._consumed(self.meter.read(0 if item is None else item_size(item), consistent=ConsistentRead))
+        if item is not None:
+            response['Item'] = _project(item, ProjectionExpression)
+        return response
+
+    def put_item(self, Item: Dict[str, Any], ReturnValues: str = 'NONE', **_) -> Dict[str, Any]:
+        with self._lock:
+            previous_item = self.items.get(Item[self.hash_key])
+            self.items[Item[self.hash_key]] = dict(Item)
+        return self._returned(self._consumed(self.meter.write(item_size(Item))), previous_item, ReturnValues)
+
+    def delete_item(self, Key: Dict[str, Any], ReturnValues: str = 'NONE', **_) -> Dict[str, Any]:
+        with self._lock:
+            item = self.items.pop(Key[self.hash_key], None)
+        return self._returned(self._consumed(self.meter.write(0 if item is None else item_size(item))), item,
+                              ReturnValues)
+
+    @staticmethod
+    def _returned(response: Dict[str, Any], previous_item: Union[None, Dict[str, Any]],
+                  return_values: str) -> Dict[str, Any]:
+        if return_values == 'ALL_OLD' and previous_item is not None:
+            response['Attributes'] = dict(previous_item)
+        return response
+
+    @staticmethod
+    def _check_condition(item: Union[None, Dict[str, Any]], condition: str, values: Dict[str, Any]) -> None:
+        """ supports the single comparisons written by page_marks_db """
+        from botocore.exceptions import ClientError
+        item = item or dict()
+        match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((\w+)\)|(\w+) = (:\w+)', condition.strip())
+        if match is None:
+            raise NotImplementedError(condition)
+        if match.group(1) == 'attribute_exists':
+            holds = match.group(2) in item
+        elif match.group(1) == 'attribute_not_exists':
+            holds = match.group(2) not in item
+        else:
+            holds = item.get(match.group(3)) == values[match.group(4)]
+        if not holds:
+            raise ClientError(dict(Error=dict(Code='ConditionalCheckFailedException',
+                                              Message='The conditional request failed')), 'UpdateItem')
+
+    def update_item(self, Key: Dict[str, Any], UpdateExpression: str,
+                    ExpressionAttributeNames: Union[None, Dict[str, str]] = None,
+                    ExpressionAttributeValues: Union[None, Dict[str, Any]] = None,
+                    ReturnValues: str = 'NONE', ConditionExpression: Union[None, str] = None,
+                    **_) -> Dict[str, Any]:
+        """ supports the SET, REMOVE, ADD and DELETE clauses written by page_marks_db """
+        names = ExpressionAttributeNames or dict()
+        values = ExpressionAttributeValues or dict()
+        with self._lock:
+            key = Key[self.hash_key]
+            if ConditionExpression is not None:
+                self._check_condition(self.items.get(key), ConditionExpression, values)
+            item = self.items.setdefault(key, dict(Key))
+            previous_size = item_size(item)
+            updated = dict()
+            clause = None
+            for token in UpdateExpression.replace(',', ' , ').split():
+                if token in ('SET', 'REMOVE', 'ADD', 'DELETE'):
+                    clause, operands = token, []
+                    continue
+                operands.append(token)
+                if clause == 'REMOVE' and token != ',':
+                    item.pop(names.get(token, token), None)
+                elif clause == 'SET' and len(operands) == 3 and operands[1] == '=':
+                    name = names.get(operands[0], operands[0])
+                    item[name] = updated[name] = values[operands[2]]
+                    operands = []
+                elif clause == 'ADD' and len(operands) == 2:
+                    name = names.get(operands[0], operands[0])
+                    value = values[operands[1]]
+                    if isinstance(value, set):
+                        item[name] = updated[name] = item.get(name, set()) | value
+                    else:
+                        item[name] = updated[name] = item.get(name, 0) + value
+                    operands = []
+                elif clause == 'DELETE' and len(operands) == 2:
+                    name = names.get(operands[0], operands[0])
+                    remaining = item.get(name, set()) - values[operands[1]]
+                    # dynamodb removes emptied sets
+                    if remaining:
+                        item[name] = updated[name] = remaining
+                    else:
+                        item.pop(name, None)
+                    operands = []
+                elif token == ',':
+                    operands = []
+        response = self._consumed(self.meter.write(max(previous_size, item_size(item))))
+        if ReturnValues == 'UPDATED_NEW':
+            response['Attributes'] = updated
+        return response
+
+    def scan(self, ProjectionExpression: Union[None, str] = None, FilterExpression: Any = None,
+             Segment: int = 0, TotalSegments: int = 1, ExclusiveStartKey: Union[None, Dict[str, Any]] = None,
+             **_) -> Dict[str, Any]:
+        """
+        reads up to 1MB of items of the segment like dynamodb.
+        the filter is the only one used by page_marks_db: items that are not page marks are dropped.
+        """
+        keys = [key for key in self.items if zlib.crc32(key.encode('utf8')) % TotalSegments == Segment]
+        start = 0 if ExclusiveStartKey is None else keys.index(ExclusiveStartKey[self.hash_key]) + 1
+        read_size = 0
+        page_items = []
+        position = start
+        while position < len(keys) and read_size < SCAN_PAGE_SIZE:
+            item = self.items[keys[position]]
+            read_size += item_size(item)
+            if FilterExpression is None or not keys[position].startswith('#'):
+                page_items.append(_project(item, ProjectionExpression))
+            position += 1
+        response = dict(Items=page_items, Count=len(page_items), **self._consumed(self.meter.read(read_size)))
+        if position < len(keys):
+            response['LastEvaluatedKey'] = {self.hash_key: keys[position - 1]}
+        return response
+
+    def batch_writer(self) -> _BatchWriter:
+        return _BatchWriter(self)
+
+
+class FakeDynamoResource:
+    """ tables are created on first use """
+
+    def __init__(self, meter: Union[None, CapacityMeter] = None):
+        self.meter = meter or CapacityMeter()
+        self.tables: Dict[str, FakeTable] = dict()
+        self._lock = threading.Lock()
+
+    def Table(self, name: str) -> FakeTable:
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(name, self.meter)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems: Dict[str, Dict[str, Any]], **_) -> Dict[str, Any]:
+        responses = dict()
+        consumed_capacities = []
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            item_responses = [table.get_item(Key=key, ProjectionExpression=request.get('ProjectionExpression'))
+                              for key in request['Keys']]
+            responses[table_name] = [response['Item'] for response in item_responses if 'Item' in response]
+            consumed_capacities.append(dict(TableName=table_name, CapacityUnits=sum(
+                response['ConsumedCapacity']['CapacityUnits'] for response in item_responses)))
+        return dict(Responses=responses, UnprocessedKeys=dict(), ConsumedCapacity=consumed_capacities)
+
+
+class FakeSes:
+    """ records the sent emails, bulk sends fail for the given share of destinations """
+
+    def __init__(self, failure_rate: float = 0., seed: int = 0):
+        self.sent: List[Dict[str, Any]] = []
+        self.bulk_calls = 0
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._ids = count()
+
+    def send_email(self, **kwargs) -> Dict[str, Any]:
+        self.sent.append(kwargs)
+        return dict(MessageId=f'fake-message-{next(self._ids)}')
+
+    def send_bulk_templated_email(self, Destinations: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        self.bulk_calls += 1
+        statuses = []
+        for destination in Destinations:
+            if self._random.random() < self.failure_rate:
+                statuses.append(dict(Status='TransientFailure', Error='fake transient failure'))
+                continue
+            template_data = json.loads(destination['ReplacementTemplateData'])
+            self.sent.append(dict(kwargs, Destination=destination['Destination'],
+                                  Message=dict(Body=dict(Html=dict(Data=template_data['html_body']),
+                                                         Text=dict(Data=template_data['text_body'])))))
+            statuses.append(dict(Status='Success', MessageId=f'fake-message-{next(self._ids)}'))
+        return dict(Status=statuses)
+
+    @property
+    def sent_bytes(self) -> int:
+        return sum(len(body['Data'].encode('utf8'))
+                   for message in self.sent for body in message['Message']['Body'].values())
+
+
+class FakeS3:
+    """ records the stored objects with their metadata """
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = dict()
+        self.metadata: Dict[str, Dict[str, str]] = dict()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, Metadata: Union[None, Dict[str, str]] = None,
+                   **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+            self.objects[f'{Bucket}/{Key}'] = Body if isinstance(Body, bytes) else Body.read()
+            self.metadata[f'{Bucket}/{Key}'] = dict(Metadata or {})
+        return dict()
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            self.requests += 1
+            if f'{Bucket}/{Key}' not in self.objects:
+                raise ClientError(dict(Error=dict(Code='404', Message='Not Found')), 'HeadObject')
+            return dict(ContentLength=len(self.objects[f'{Bucket}/{Key}']), Metadata=self.metadata[f'{Bucket}/{Key}'])
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            self.requests += 1
+            if f'{Bucket}/{Key}' not in self.objects:
+                raise ClientError(dict(Error=dict(Code='NoSuchKey', Message='Not Found')), 'GetObject')
+            return dict(Body=io.BytesIO(self.objects[f'{Bucket}/{Key}']), Metadata=self.metadata[f'{Bucket}/{Key}'])
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+            self.objects.pop(f'{Bucket}/{Key}', None)
+            self.metadata.pop(f'{Bucket}/{Key}', None)
+        return dict()
+
+
+class ReleaseFeed:
+    """
+    synthetic pages of the mangaupdates release feed, from today to older days.
+    a share of the records are releases of watched series, with chapters after the ones they already have.
+    """
+
+    def __init__(self, watched_series_ids: Sequence[str], history: int, pages: int = 10, records_per_page: int = 40,
+                 pages_per_day: int = 3, watched_share: float = .2, seed: int = 0):
+        self.pages = pages
+        self.records_per_page = records_per_page
+        self.pages_per_day = pages_per_day
+        self.watched_share = watched_share
+        self.history = history
+        self.watched_series_ids = [int(serie_id) for serie_id in watched_series_ids]
+        self.seed = seed
+        self.requests = 0
+
+    def page(self, page: int) -> Dict[str, Any]:
+        if page >= self.pages:
+            return dict(results=[])
+        rand = random.Random(self.seed * 100003 + page)
+        release_date = (date.today() - timedelta(days=page // self.pages_per_day)).isoformat()
+        results = []
+        for position in range(self.records_per_page):
+            record_id = page * self.records_per_page + position
+            if self.watched_series_ids and rand.random() < self.watched_share:
+                serie_id = rand.choice(self.watched_series_ids)
+            else:
+                serie_id = 10 ** 9 + rand.randint(0, 10 ** 6)
+            results.append(dict(
+                metadata=dict(series=dict(series_id=serie_id, title=f'serie {serie_id}')),
+                record=dict(id=record_id,
+                            title=f'serie {serie_id}',
+                            volume=None,
+                            chapter=str(self.history + record_id),
+                            groups=[dict(name=f'group {rand.randint(0, 50)}', group_id=1)],
+                            release_date=release_date)))
+        return dict(total_hits=self.pages * self.records_per_page, page=page + 1,
+                    per_page=self.records_per_page, results=results)
+
+
+def _json_response(url: str, status_code: int, payload: Any) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(payload).encode('utf8')
+    return response
+
+
+class FakeHttpSession:
+    """ answers the release feed requests, any other request gets a 404 """
+
+    def __init__(self, feed: ReleaseFeed):
+        self.feed = feed
+        self.requests = 0
+        self.sent_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        parsed_url = urllib.parse.urlparse(url)
+        query = dict(urllib.parse.parse_qsl(parsed_url.query))
+        query.update(kwargs.get('params') or {})
+        if parsed_url.path.endswith('/releases/days'):
+            response = _json_response(url, 200, self.feed.page(int(query.get('page', 0))))
+        else:
+            response = _json_response(url, 404, dict(reason='not found'))
+        with self._lock:
+            self.requests += 1
+            self.sent_bytes += len(response.content)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        with self._lock:
+            self.requests += 1
+        return _json_response(url, 404, dict(reason='not found'))
+
+
+class FakeServices:
+    """ the stand-ins of one run """
+
+    def __init__(self, feed: ReleaseFeed):
+        self.dynamodb = FakeDynamoResource()
+        self.ses = FakeSes()
+        self.s3 = FakeS3()
+        self.http = FakeHttpSession(feed)
+
+    def client(self, service_name: str, *args, **kwargs):
+        if service_name == 'ses':
+            return self.ses
+        if service_name == 's3':
+            return self.s3
+        raise ValueError(f'No stand-in for the {service_name} client')
+
+    def resource(self, service_name: str, *args, **kwargs):
+        if service_name == 'dynamodb':
+            return self.dynamodb
+        raise ValueError(f'No stand-in for the {service_name} resource')
+
+
+def _clear_client_caches() -> None:
+    """ clients created on first use by the lambda modules """
+    import page_marks_db
+    import emailing.helper
+    import img_hosting
+    for getter in (page_marks_db._get_resource, page_marks_db._get_table, page_marks_db._get_archive_table,
+                   emailing.helper._get_ses_client, img_hosting._get_s3_client):
+        getter.cache_clear()
+    img_hosting._signed_urls_window = None
+    page_marks_db._cached_page_marks = None
+
+
+@contextmanager
+def fake_services(feed: ReleaseFeed) -> Iterator[FakeServices]:
+    """ every aws client and the http session of the lambda modules use the stand-ins within the context """
+    import boto3
+    import http_session
+    services = FakeServices(feed)
+    session = mock.Mock()
+    session.resource.side_effect = services.resource
+    session.client.side_effect = services.client
+    _clear_client_caches()
+    previous_session = http_session._session
+    http_session._session = services.http
+    try:
+        with mock.patch.object(boto3, 'client', services.client), \
+                mock.patch.object(boto3, 'resource', services.resource), \
+                mock.patch.object(boto3.session, 'Session', return_value=session):
+            yield services
+    finally:
+        http_session._session = previous_session
+        _clear_client_caches()
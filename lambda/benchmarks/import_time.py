@@ -0,0 +1,59 @@
+"""
+Measures the import time of the lambda handler, as paid on every cold start.
+Each run imports the module in a new interpreter with `python -X importtime`.
+run from the lambda folder: `python -m benchmarks.import_time`
+"""
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+import click
+
+# modules that must not be imported before the handler runs
+DEFERRED_MODULES = ('boto3', 'botocore', 'jinja2', 'dateutil', 'rsa', 'backoff')
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """ self and cumulative import time in microseconds by imported module, in a new interpreter """
+    environment = dict(os.environ)
+    environment.setdefault('AWS_REGION_SCRAPPING', 'us-east-1')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               capture_output=True, text=True, env=environment)
+    if completed.returncode != 0:
+        raise click.ClickException(f'Importing {module} failed:\n{completed.stderr}')
+    times = dict()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time), int(cumulative_time))
+    return times
+
+
+@click.command()
+@click.option('--module', default='main', help='Module imported, main being the lambda handler.')
+@click.option('--repeat', default=5, help='Number of runs, the best one is reported.')
+@click.option('--top', default=15, help='Number of slowest imports displayed.')
+@click.option('--max-ms', default=None, type=float, help='Fails when the import takes longer.')
+def benchmark(module: str, repeat: int, top: int, max_ms: float):
+    """ reports the import time of the module and fails if it loads deferred modules or is too slow """
+    runs: List[Dict[str, Tuple[int, int]]] = [import_times(module) for _ in range(repeat)]
+    best_run = min(runs, key=lambda times: times[module][1])
+    total_ms = best_run[module][1] / 1000
+    click.echo(f'import {module}: {total_ms:.1f} ms (best of {repeat}), {len(best_run)} modules')
+    slowest = sorted(best_run.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    click.echo(f'{"module":<40}{"self ms":>10}{"cumulative ms":>16}')
+    for name, (self_time, cumulative_time) in slowest:
+        click.echo(f'{name:<40}{self_time / 1000:>10.1f}{cumulative_time / 1000:>16.1f}')
+
+    eagerly_imported = sorted({name.split('.')[0] for name in best_run} & set(DEFERRED_MODULES))
+    if eagerly_imported:
+        raise click.ClickException(f'{", ".join(eagerly_imported)} imported by {module}, they should be imported on '
+                                   f'first use.')
+    if max_ms is not None and total_ms > max_ms:
+        raise click.ClickException(f'import {module} took {total_ms:.1f} ms, more than {max_ms} ms')
+
+
+if __name__ == '__main__':
+    benchmark()
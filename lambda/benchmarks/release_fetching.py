@@ -0,0 +1,57 @@
+"""
+Measures the release fetching against the local stand-in of the mangaupdates api (benchmarks/stub_server.py),
+for several fetch concurrencies, with latency and error rates.
+run from the lambda folder: `python -m benchmarks.release_fetching --latency 0.1 --concurrency 1 --concurrency 4`
+"""
+from datetime import date, timedelta
+import time
+from typing import List
+
+import click
+import requests
+
+import mangaupdate_srv
+from benchmarks.stub_server import StubOptions, start_in_thread
+
+
+@click.command()
+@click.option('--concurrency', 'concurrencies', multiple=True, type=int, default=[1, 3, 6],
+              help='Number of pages requested in parallel, can be given several times.')
+@click.option('--latency', default=.05, help='Seconds added to every response.')
+@click.option('--jitter', default=.02, help='Up to that many seconds randomly added to every response.')
+@click.option('--pages', default=20, help='Number of release pages read.')
+@click.option('--records-per-page', default=40, help='Number of releases per page.')
+@click.option('--throttle-rate', default=0., help='Share of the requests answered with a 429.')
+@click.option('--error-rate', default=0., help='Share of the requests answered with a 503.')
+@click.option('--recordings', 'recordings_dir', default=StubOptions.recordings_dir,
+              help='Folder of the recorded responses replayed by the stand-in.')
+@click.option('--seed', default=0)
+def benchmark(concurrencies: List[int], pages: int, **options):
+    """ reads all the pages of the feed with each concurrency and reports time and requests """
+    pages_per_day = 3
+    until = date.today() - timedelta(days=(pages - 1) // pages_per_day)
+    for concurrency in concurrencies:
+        # a new server per run so that errors are drawn the same way
+        server, state, base_url = start_in_thread(StubOptions(pages=pages, pages_per_day=pages_per_day, **options))
+        previous_base_url = mangaupdate_srv.MANGAUPDATES_API_URL
+        mangaupdate_srv.MANGAUPDATES_API_URL = base_url
+        start = time.perf_counter()
+        try:
+            series_releases = mangaupdate_srv.get_releases(until, concurrency=concurrency)
+            outcome = f'{sum(len(serie_releases.releases) for serie_releases in series_releases)} releases'
+        except requests.HTTPError as e:
+            outcome = f'failed: {e}'
+        finally:
+            duration = time.perf_counter() - start
+            mangaupdate_srv.MANGAUPDATES_API_URL = previous_base_url
+            server.shutdown()
+            server.server_close()
+        read_pages = min(state.statistics['release pages'], pages)
+        statuses = ', '.join(f'{status}: {state.statistics[status]}'
+                             for status in ('200', '429', '503') if state.statistics[status])
+        click.echo(f'concurrency {concurrency:>2}: {duration * 1000:>8.1f} ms, {read_pages / duration:>7.1f} pages/s, '
+                   f'{state.statistics["requests"]} requests ({statuses}), {outcome}')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,239 @@
+"""
+Local stand-in of the mangaupdates api, to measure the release fetching without network access.
+It replays recorded responses of /releases/days, /series/{id} and /series/search, and generates the missing ones.
+Latency, pagination depth, 429 and 5xx error rates and page sizes can be set.
+
+record responses of the api: `python -m benchmarks.stub_server --record-from https://api.mangaupdates.com/v1`
+replay them: `python -m benchmarks.stub_server --latency 0.08 --error-rate 0.05`
+then run the lambda with `MANGAUPDATES_API_URL=http://localhost:8080`.
+"""
+from collections import Counter
+from dataclasses import dataclass
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Any, Tuple, Union
+import urllib.parse
+
+import click
+import requests
+
+from benchmarks.fakes import ReleaseFeed
+
+_SERIE_PATH_REGEX = re.compile(r'^/series/(?P<serie_id>[0-9]+)$')
+_IMAGE_PATH_REGEX = re.compile(r'^/images/(?P<serie_id>[0-9]+)\.gif$')
+# 1x1 transparent gif served as cover of generated series
+_PIXEL_GIF = bytes.fromhex('47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b')
+
+
+@dataclass
+class StubOptions:
+    recordings_dir: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+    record_from: Union[None, str] = None  # upstream api proxied and recorded
+    latency: float = 0.  # seconds added to every response
+    jitter: float = 0.  # seconds, up to that much latency is randomly added
+    pages: int = 10  # release pages served, the following ones are empty
+    records_per_page: Union[None, int] = None  # recorded pages are resized to it, generated ones default to 40
+    pages_per_day: int = 3
+    throttle_rate: float = 0.  # share of requests answered with a 429
+    error_rate: float = 0.  # share of requests answered with a 503
+    seed: int = 0
+
+
+class StubState:
+    """ options, recordings and statistics shared by the request handlers """
+
+    def __init__(self, options: StubOptions):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.feed = ReleaseFeed(watched_series_ids=[], history=0, pages=options.pages,
+                                records_per_page=options.records_per_page or 40,
+                                pages_per_day=options.pages_per_day, seed=options.seed)
+        self.statistics: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.statistics[key] += 1
+
+    def _recording_path(self, method: str, path: str, query: str, body: bytes) -> str:
+        key = hashlib.sha1(f'{method} {path}?{query}'.encode('utf8') + body).hexdigest()
+        return os.path.join(self.options.recordings_dir, f'{key}.json')
+
+    def load_recording(self, method: str, path: str, query: str, body: bytes) -> Union[None, Dict[str, Any]]:
+        try:
+            with open(self._recording_path(method, path, query, body), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, method: str, path: str, query: str, body: bytes) -> Dict[str, Any]:
+        """ forwards the request upstream and stores the response """
+        url = f'{self.options.record_from.rstrip("/")}{path}' + (f'?{query}' if query else '')
+        response = requests.request(method, url, data=body or None,
+                                    headers={'Content-Type': 'application/json'} if body else None)
+        recording = dict(status=response.status_code,
+                         content_type=response.headers.get('Content-Type', 'application/json'),
+                         body=response.text)
+        if response.status_code == 200:
+            os.makedirs(self.options.recordings_dir, exist_ok=True)
+            with open(self._recording_path(method, path, query, body), 'w') as f:
+                json.dump(recording, f)
+        return recording
+
+
+def _resize_page(page: Dict[str, Any], records_per_page: int) -> Dict[str, Any]:
+    """
+    repeats or truncates the records of a recorded page.
+    repeated records get new integer ids, as the release cursor stores ids as integers.
+    """
+    results = page.get('results') or []
+    if not results:
+        return page
+    resized_results = []
+    for position in range(records_per_page):
+        record = json.loads(json.dumps(results[position % len(results)]))
+        if position >= len(results) and isinstance(record.get('record'), dict):
+            record['record']['id'] = int(record['record'].get('id') or 0) * 1000 + position
+        resized_results.append(record)
+    return dict(page, results=resized_results, per_page=records_per_page)
+
+
+def _generated_serie(serie_id: int, base_url: str) -> Dict[str, Any]:
+    return dict(series_id=serie_id,
+                title=f'serie {serie_id}',
+                image=dict(url=dict(original=f'{base_url}/images/{serie_id}.gif')))
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """ paths are the ones of the api relative to its base url, as is the recorded upstream """
+    state: StubState
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, content_type: str, body: bytes, headers: Union[None, Dict[str, str]] = None) -> None:
+        self.state.count(str(status))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: Any, status: int = 200) -> None:
+        self._send(status, 'application/json', json.dumps(payload).encode('utf8'))
+
+    def _base_url(self) -> str:
+        return f'http://{self.headers.get("Host", "localhost")}'
+
+    def _handle(self, method: str) -> None:
+        options = self.state.options
+        parsed_url = urllib.parse.urlparse(self.path)
+        query = parsed_url.query
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.state.count('requests')
+        delay = options.latency + options.jitter * self.state.draw()
+        if delay:
+            time.sleep(delay)
+        draw = self.state.draw()
+        if draw < options.throttle_rate:
+            return self._send(429, 'application/json', b'{"reason": "throttled"}', {'Retry-After': '1'})
+        if draw < options.throttle_rate + options.error_rate:
+            return self._send(503, 'application/json', b'{"reason": "unavailable"}')
+
+        if _IMAGE_PATH_REGEX.match(parsed_url.path):
+            return self._send(200, 'image/gif', _PIXEL_GIF)
+        if options.record_from is not None:
+            recording = self.state.record(method, parsed_url.path, query, body)
+        else:
+            recording = self.state.load_recording(method, parsed_url.path, query, body)
+        if parsed_url.path == '/releases/days':
+            return self._send_releases(dict(urllib.parse.parse_qsl(query)), recording)
+        if recording is not None:
+            return self._send(recording['status'], recording['content_type'], recording['body'].encode('utf8'))
+        serie_match = _SERIE_PATH_REGEX.match(parsed_url.path)
+        if method == 'GET' and serie_match:
+            return self._send_json(_generated_serie(int(serie_match.group('serie_id')), self._base_url()))
+        if method == 'POST' and parsed_url.path == '/series/search':
+            keywords = json.loads(body or b'{}').get('search', '')
+            first_id = int(hashlib.sha1(keywords.encode('utf8')).hexdigest()[:8], 16)
+            return self._send_json(dict(results=[dict(record=_generated_serie(first_id + position, self._base_url()))
+                                                 for position in range(20)]))
+        return self._send_json(dict(reason=f'no stand-in for {method} {parsed_url.path}'), status=404)
+
+    def _send_releases(self, query: Dict[str, str], recording: Union[None, Dict[str, Any]]) -> None:
+        options = self.state.options
+        page = int(query.get('page', 0))
+        self.state.count('release pages')
+        if page >= options.pages:
+            return self._send_json(dict(results=[]))
+        if recording is None or recording['status'] != 200:
+            return self._send_json(self.state.feed.page(page))
+        payload = json.loads(recording['body'])
+        if options.records_per_page is not None:
+            payload = _resize_page(payload, options.records_per_page)
+        return self._send_json(payload)
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+
+def make_server(options: StubOptions, host: str = 'localhost', port: int = 0) -> Tuple[ThreadingHTTPServer, StubState]:
+    """ server answering in a thread per request, port 0 picks a free one """
+    state = StubState(options)
+    handler = type('BoundStubRequestHandler', (StubRequestHandler,), dict(state=state))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+def start_in_thread(options: StubOptions) -> Tuple[ThreadingHTTPServer, StubState, str]:
+    """ starts a server on a free port, returns it with its state and base url. stop it with server.shutdown() """
+    server, state = make_server(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'http://{server.server_address[0]}:{server.server_address[1]}'
+
+
+@click.command()
+@click.option('--host', default='localhost')
+@click.option('--port', default=8080)
+@click.option('--recordings', 'recordings_dir', default=StubOptions.recordings_dir,
+              help='Folder of the recorded responses.')
+@click.option('--record-from', default=None, help='Api base url to forward requests to and record responses from.')
+@click.option('--latency', default=0., help='Seconds added to every response.')
+@click.option('--jitter', default=0., help='Up to that many seconds randomly added to every response.')
+@click.option('--pages', default=10, help='Number of release pages served.')
+@click.option('--records-per-page', default=None, type=int, help='Number of releases per page.')
+@click.option('--pages-per-day', default=3, help='Number of generated release pages per day.')
+@click.option('--throttle-rate', default=0., help='Share of the requests answered with a 429.')
+@click.option('--error-rate', default=0., help='Share of the requests answered with a 503.')
+@click.option('--seed', default=0)
+def serve(host: str, port: int, **options):
+    """ serves until interrupted then prints the number of requests by status """
+    server, state = make_server(StubOptions(**options), host, port)
+    click.echo(f'Serving on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        click.echo(', '.join(f'{key}: {value}' for key, value in sorted(state.statistics.items())))
+
+
+if __name__ == '__main__':
+    serve()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 ERROR_FLAG = 'ERROR'
 SENDING_EMAIL = os.environ.get('NEWSLETTER_SENDER')
@@ -7,3 +8,31 @@ AWS_REGION = os.environ.get('AWS_REGION_SCRAPPING')
 CLOUD_FRONT_SECRET_KEY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cloudfront-secret.key")
 SES_CONFIGURATION_SET = 'scrapping_config_set'
 EMAIL_VALIDITY = 7
+RELEASES_FETCH_CONCURRENCY = int(os.environ.get('RELEASES_FETCH_CONCURRENCY', 3))  # pages requested in parallel
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', max(10, RELEASES_FETCH_CONCURRENCY)))  # kept alive connections
+HTTP_CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'manga_scraping_http_cache'))
+HTTP_CACHE_MAX_ENTRIES = int(os.environ.get('HTTP_CACHE_MAX_ENTRIES', 512))
+RELEASE_CURSOR_OVERLAP_DAYS = int(os.environ.get('RELEASE_CURSOR_OVERLAP_DAYS', 1))  # rescanned to catch late releases
+PAGE_MARKS_SCAN_SEGMENTS = int(os.environ.get('PAGE_MARKS_SCAN_SEGMENTS', 1))  # parallel scan of the page marks table
+PAGE_MARKS_CACHE_FILE = os.environ.get('PAGE_MARKS_CACHE_FILE',
+                                       os.path.join(tempfile.gettempdir(), 'manga_scraping_page_marks.pickle'))
+CHAPTER_WORKING_SET_SIZE = int(os.environ.get('CHAPTER_WORKING_SET_SIZE', 100))  # chapters per serie kept out of archive
+SIGNED_URL_WINDOW = int(os.environ.get('SIGNED_URL_WINDOW', 3600))  # seconds, image urls expiring in a window are reused
+# signs a single policy allowing every image of the distribution instead of one signature per image
+CLOUD_FRONT_WILDCARD_POLICY = os.environ.get('CLOUD_FRONT_WILDCARD_POLICY', '') == '1'
+# base url of the api, can point to a local stand-in (see benchmarks/stub_server.py)
+MANGAUPDATES_API_URL = os.environ.get('MANGAUPDATES_API_URL', 'https://api.mangaupdates.com/v1').rstrip('/')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'MangaScraping')  # cloudwatch namespace of the run metrics
+SES_NEWSLETTER_TEMPLATE = os.environ.get('SES_NEWSLETTER_TEMPLATE', 'manga_newsletter')  # used to send to subscribers
+SES_BULK_MAX_DESTINATIONS = 50  # ses limit of send_bulk_templated_email
+SES_BULK_MAX_BYTES = int(os.environ.get('SES_BULK_MAX_BYTES', 8 * 1024 * 1024))  # template data sent per bulk call
+SES_SEND_MAX_ATTEMPTS = int(os.environ.get('SES_SEND_MAX_ATTEMPTS', 3))  # per destination, on transient failures
+EMAIL_RENDER_CONCURRENCY = int(os.environ.get('EMAIL_RENDER_CONCURRENCY', 4))  # newsletters rendered in parallel
+IMAGE_BACKFILL_CONCURRENCY = int(os.environ.get('IMAGE_BACKFILL_CONCURRENCY', 8))  # covers fetched and uploaded in parallel
+# covers of the mail are resized variants, '1' once image_backfill.py hosted the variants of the existing covers
+MAIL_IMAGE_VARIANTS = os.environ.get('MAIL_IMAGE_VARIANTS', '0') == '1'
+# results of the mangaupdates lookups repeated by the admin tools
+LOOKUP_CACHE_DIR = os.environ.get('LOOKUP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'manga_scraping_lookup_cache'))
+LOOKUP_CACHE_TTL = int(os.environ.get('LOOKUP_CACHE_TTL', 24 * 3600))  # seconds
+LOOKUP_CACHE_MAX_ENTRIES = int(os.environ.get('LOOKUP_CACHE_MAX_ENTRIES', 256))  # least recently used evicted above
+SERIE_IMPORT_CONCURRENCY = int(os.environ.get('SERIE_IMPORT_CONCURRENCY', 8))  # series resolved and covers uploaded in parallel
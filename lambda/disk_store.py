@@ -0,0 +1,66 @@
+"""
+Small on disk store shared by the caches of http_session and lookup_cache: one pickled entry per file, written
+atomically, the least recently used entries being removed above a number of entries.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+from typing import Any, Tuple, Union
+
+from logs import logger
+
+
+class DiskStore:
+    """ values by key with the time they were stored at, the modification time of an entry is its last use """
+
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{hashlib.sha1(key.encode("utf8")).hexdigest()}.pickle')
+
+    def get(self, key: str) -> Union[None, Tuple[float, Any]]:
+        """ returns the time the value of key was stored at and the value, or None if absent """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, stored_at, value = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return stored_at, value
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f'{path}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump((key, time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+                self._evict()
+            except OSError:
+                logger.warning(f'Failed to store {key} in {self.directory}', exc_info=True)
+
+    def _evict(self) -> None:
+        """ removes the least recently used entries above max_entries """
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith('.pickle')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
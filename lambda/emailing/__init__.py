@@ -1 +1 @@
-from . import helper
+from . import helper, fan_out
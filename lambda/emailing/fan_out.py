@@ -0,0 +1,109 @@
+"""
+Sends each subscriber the releases of the series it watches, out of the releases of the run.
+Subscribers receiving the same releases share a rendering, destinations are sent by batches of bulk calls.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+from typing import List, Dict, Tuple, Iterator, Iterable
+
+from config import SES_BULK_MAX_DESTINATIONS, SES_BULK_MAX_BYTES, SES_SEND_MAX_ATTEMPTS, EMAIL_RENDER_CONCURRENCY
+from logs import logger
+from metrics import metrics
+from page_marks_db import Subscriber
+from release_formating import FormattedSerieReleases
+from .helper import build_html_body, build_txt_body, send_bulk_newsletter, make_subject
+
+# statuses of destinations worth sending again, the other failures come from the destination itself
+RETRIED_STATUSES = {'TransientFailure', 'AccountThrottled', 'Failed'}
+SEND_BASE_DELAY = .5  # seconds, doubled on each attempt
+
+
+def select_releases(updated_serie_releases: Iterable[FormattedSerieReleases], subscriber: Subscriber)\
+        -> List[FormattedSerieReleases]:
+    """ releases of the series watched by the subscriber """
+    return [serie_releases for serie_releases in updated_serie_releases
+            if serie_releases.serie_id in subscriber.serie_ids]
+
+
+def _render(serie_releases: List[FormattedSerieReleases], serie_number: int) -> str:
+    """ template data of a newsletter, the bodies are rendered here as ses templates have no loops """
+    return json.dumps(dict(subject=make_subject(),
+                           html_body=build_html_body(serie_releases, serie_number),
+                           text_body=build_txt_body(serie_releases)))
+
+
+def render_newsletters(updated_serie_releases: List[FormattedSerieReleases], subscribers: Iterable[Subscriber])\
+        -> Dict[str, str]:
+    """ template data by email, rendered once per distinct newsletter and in parallel """
+    emails_by_newsletter: Dict[Tuple[Tuple[str, ...], int], List[str]] = defaultdict(list)
+    releases_by_id = {serie_releases.serie_id: serie_releases for serie_releases in updated_serie_releases}
+    for subscriber in subscribers:
+        released_ids = tuple(serie_releases.serie_id
+                             for serie_releases in select_releases(updated_serie_releases, subscriber))
+        emails_by_newsletter[(released_ids, len(subscriber.serie_ids))].append(subscriber.email)
+    metrics.count('NewslettersRendered', len(emails_by_newsletter))
+    with ThreadPoolExecutor(max_workers=EMAIL_RENDER_CONCURRENCY) as executor:
+        renderings = executor.map(
+            lambda newsletter: _render([releases_by_id[serie_id] for serie_id in newsletter[0]], newsletter[1]),
+            emails_by_newsletter)
+        return {email: template_data
+                for emails, template_data in zip(emails_by_newsletter.values(), renderings)
+                for email in emails}
+
+
+def _batches(destinations: Iterable[Tuple[str, str]]) -> Iterator[List[Tuple[str, str]]]:
+    """ destinations grouped within the number of destinations and the size of a bulk call """
+    batch: List[Tuple[str, str]] = []
+    batch_size = 0
+    for email, template_data in destinations:
+        size = len(email) + len(template_data.encode('utf8'))
+        if batch and (len(batch) >= SES_BULK_MAX_DESTINATIONS or batch_size + size > SES_BULK_MAX_BYTES):
+            yield batch
+            batch, batch_size = [], 0
+        batch.append((email, template_data))
+        batch_size += size
+    if batch:
+        yield batch
+
+
+def _send_batch(batch: List[Tuple[str, str]]) -> List[str]:
+    """ sends a batch, then again to the destinations that failed transiently. returns the emails not sent """
+    pending = batch
+    failed_emails = []
+    for attempt in range(SES_SEND_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(SEND_BASE_DELAY * 2 ** (attempt - 1))
+            metrics.count('EmailRetries', len(pending))
+        retried = []
+        for destination, status in zip(pending, send_bulk_newsletter(pending)):
+            if status['Status'] == 'Success':
+                metrics.count('EmailsSent')
+            elif status['Status'] in RETRIED_STATUSES:
+                retried.append(destination)
+            else:
+                logger.error(f'Newsletter not sent to {destination[0]}: {status["Status"]} {status.get("Error")}')
+                failed_emails.append(destination[0])
+        pending = retried
+        if not pending:
+            break
+    for email, _ in pending:
+        logger.error(f'Newsletter not sent to {email} after {SES_SEND_MAX_ATTEMPTS} attempts.')
+        failed_emails.append(email)
+    metrics.count('EmailErrors', len(failed_emails))
+    return failed_emails
+
+
+def send_newsletters(updated_serie_releases: List[FormattedSerieReleases], subscribers: List[Subscriber]) \
+        -> List[str]:
+    """ sends every subscriber its newsletter, returns the emails it could not be sent to """
+    with metrics.span('RenderEmail'):
+        template_data_by_email = render_newsletters(updated_serie_releases, subscribers)
+    failed_emails = []
+    with metrics.span('SendEmail'):
+        for batch in _batches(template_data_by_email.items()):
+            failed_emails.extend(_send_batch(batch))
+    logger.info(f'Newsletter sent to {len(template_data_by_email) - len(failed_emails)} '
+                f'out of {len(template_data_by_email)} subscribers.')
+    return failed_emails
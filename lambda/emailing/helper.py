@@ -1,21 +1,24 @@
 from datetime import datetime
+from functools import lru_cache
 from math import ceil, floor
-import os
-from typing import List
+import json
+from typing import List, Dict, Any, Iterator, Tuple
 
-import boto3
-from botocore.exceptions import ClientError
-from jinja2 import Environment, FileSystemLoader
-
-from config import SENDING_EMAIL, RECEIVING_EMAILS, AWS_REGION, SES_CONFIGURATION_SET
+from config import SENDING_EMAIL, RECEIVING_EMAILS, AWS_REGION, SES_CONFIGURATION_SET, SES_NEWSLETTER_TEMPLATE
 from logs import logger
+from metrics import metrics
 from release_formating import FormattedSerieReleases
-
-ses_client = boto3.client('ses', region_name=AWS_REGION)
+from .templates import get_template
 
 CHARSET = "UTF-8"
 SPACES_PER_TAB = 4
-THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@lru_cache(maxsize=None)
+def _get_ses_client():
+    """ boto3 is imported and the client created on first use, then kept across warm invocations """
+    import boto3
+    return boto3.client('ses', region_name=AWS_REGION)
 
 
 def _make_todays_date() -> str:
@@ -23,19 +26,30 @@ def _make_todays_date() -> str:
     return datetime.now().strftime("%a %d-%b")
 
 
+def make_subject() -> str:
+    return f'Manga Newsletter - {_make_todays_date()}'
+
+
+def _html_context(formatted_scrapped_releases: List[FormattedSerieReleases], serie_number: int) -> Dict[str, Any]:
+    """ variables of the mail template """
+    log_link = f"https://console.aws.amazon.com/cloudwatch/home?region={AWS_REGION}" \
+               f"#logStream:group=/aws/lambda/manga_scrapping;streamFilter=typeLogStreamPrefix"
+    return dict(date_str=_make_todays_date(),
+                serie_number=serie_number,
+                all_series_releases=formatted_scrapped_releases,
+                log_link=log_link)
+
+
 def build_html_body(formatted_scrapped_releases: List[FormattedSerieReleases],
                     serie_number: int) -> str:
     """ creates an email body to be sent """
-    j2_env = Environment(loader=FileSystemLoader(THIS_DIR),
-                         trim_blocks=True,
-                         lstrip_blocks=True)
-    log_link = f"https://console.aws.amazon.com/cloudwatch/home?region={AWS_REGION}" \
-               f"#logStream:group=/aws/lambda/manga_scrapping;streamFilter=typeLogStreamPrefix"
-    return j2_env.get_template('mail_template.html').render(
-        date_str=_make_todays_date(),
-        serie_number=serie_number,
-        all_series_releases=formatted_scrapped_releases,
-        log_link=log_link)
+    return get_template().render(**_html_context(formatted_scrapped_releases, serie_number))
+
+
+def generate_html_body(formatted_scrapped_releases: List[FormattedSerieReleases],
+                       serie_number: int) -> Iterator[str]:
+    """ streams the email body piece by piece, to write very large newsletters without holding them in memory """
+    return get_template().generate(**_html_context(formatted_scrapped_releases, serie_number))
 
 
 def build_txt_body(formatted_scrapped_releases: List[FormattedSerieReleases]) -> str:
@@ -71,17 +85,40 @@ def build_txt_body(formatted_scrapped_releases: List[FormattedSerieReleases]) ->
 
 
 def send_newsletter(html_body: str, text_body: str):
+    from botocore.exceptions import ClientError
     recipients = RECEIVING_EMAILS
     try:
-        response = ses_client.send_email(
+        response = _get_ses_client().send_email(
             Destination={'ToAddresses': recipients},
             Message={
                 'Body': {'Html': {'Charset': CHARSET, 'Data': html_body},
                          'Text': {'Charset': CHARSET, 'Data': text_body}},
-                'Subject': {'Charset': CHARSET, 'Data': f'Manga Newsletter - {_make_todays_date()}'}},
+                'Subject': {'Charset': CHARSET, 'Data': make_subject()}},
             Source=SENDING_EMAIL,
             ConfigurationSetName=SES_CONFIGURATION_SET)
     except ClientError as e:
+        metrics.count('EmailErrors')
         logger.error(e.response['Error']['Message'], exc_info=True)
     else:
+        metrics.count('EmailsSent')
         logger.info(f"Email sent! Message ID: {response['MessageId']}")
+
+
+def send_bulk_newsletter(destinations: List[Tuple[str, str]]) -> List[Dict[str, str]]:
+    """
+    sends the newsletter template to each email with its json template data, in a single call.
+    returns the status of each destination, a failure of the whole call is reported as failed for all of them.
+    """
+    from botocore.exceptions import ClientError
+    try:
+        response = _get_ses_client().send_bulk_templated_email(
+            Source=SENDING_EMAIL,
+            ConfigurationSetName=SES_CONFIGURATION_SET,
+            Template=SES_NEWSLETTER_TEMPLATE,
+            DefaultTemplateData=json.dumps(dict(subject=make_subject(), html_body='', text_body='')),
+            Destinations=[dict(Destination={'ToAddresses': [email]}, ReplacementTemplateData=template_data)
+                          for email, template_data in destinations])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'], exc_info=True)
+        return [dict(Status='Failed', Error=e.response['Error']['Message'])] * len(destinations)
+    return response['Status']
@@ -0,0 +1,80 @@
+"""
+Jinja environment of the newsletter, created once per process.
+Templates can be precompiled at build time to skip their compilation on cold starts:
+run from the lambda folder `python -m emailing.templates` before zipping the code.
+"""
+from functools import lru_cache
+import hashlib
+import json
+import os
+from typing import Dict, TYPE_CHECKING
+
+from logs import logger
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, BaseLoader, Template
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPILED_TEMPLATES_DIR = os.path.join(TEMPLATE_DIR, 'compiled_templates')
+# checksums of the templates that were compiled, so that an outdated compilation is ignored
+COMPILED_TEMPLATES_MANIFEST = os.path.join(COMPILED_TEMPLATES_DIR, 'sources.json')
+MAIL_TEMPLATE = 'mail_template.html'
+
+
+def _template_checksums() -> Dict[str, str]:
+    checksums = dict()
+    for name in os.listdir(TEMPLATE_DIR):
+        if name.endswith('.html'):
+            with open(os.path.join(TEMPLATE_DIR, name), 'rb') as f:
+                checksums[name] = hashlib.sha1(f.read()).hexdigest()
+    return checksums
+
+
+def _make_environment(loader: 'BaseLoader') -> 'Environment':
+    """ compiled templates depend on these options, they must be the same when compiling and loading """
+    from jinja2 import Environment
+    return Environment(loader=loader,
+                       trim_blocks=True,
+                       lstrip_blocks=True)
+
+
+def _compiled_templates_are_valid() -> bool:
+    try:
+        with open(COMPILED_TEMPLATES_MANIFEST, 'r') as f:
+            compiled_checksums = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if compiled_checksums != _template_checksums():
+        logger.warning(f'Ignoring outdated precompiled templates in {COMPILED_TEMPLATES_DIR}')
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def get_environment() -> 'Environment':
+    """ environment loading the precompiled templates when they are up to date and compiling the others """
+    from jinja2 import FileSystemLoader, ModuleLoader, ChoiceLoader
+    file_system_loader = FileSystemLoader(TEMPLATE_DIR)
+    if _compiled_templates_are_valid():
+        return _make_environment(ChoiceLoader([ModuleLoader(COMPILED_TEMPLATES_DIR), file_system_loader]))
+    return _make_environment(file_system_loader)
+
+
+def get_template(name: str = MAIL_TEMPLATE) -> 'Template':
+    """ template loaded once, jinja caches it in the environment """
+    return get_environment().get_template(name)
+
+
+def precompile_templates() -> None:
+    """ compiles the templates into python modules loaded by get_environment """
+    from jinja2 import FileSystemLoader
+    environment = _make_environment(FileSystemLoader(TEMPLATE_DIR))
+    environment.compile_templates(COMPILED_TEMPLATES_DIR, zip=None, ignore_errors=False,
+                                  filter_func=lambda name: name.endswith('.html'))
+    with open(COMPILED_TEMPLATES_MANIFEST, 'w') as f:
+        json.dump(_template_checksums(), f)
+
+
+if __name__ == '__main__':
+    precompile_templates()
+    print(f'Templates compiled in {COMPILED_TEMPLATES_DIR}')
@@ -1,20 +1,76 @@
 from abc import abstractmethod
+from array import array
+from functools import lru_cache
+from math import inf
+import json
 import re
-from typing import Union, Generic, TypeVar, Dict, Any
+from typing import Union, Generic, TypeVar, Dict, Any, Tuple, Iterable, Sequence, List
+import zlib
 
 from logs import logger
 
 _SerializableClass = TypeVar('_SerializableClass')
+KEYWORD_GROUP = 'keyword'
 LETTER_GROUP = 'letter'
+SUB_CHAPTER_GROUP = 'sub_chapter'
 NUMBER_GROUP = 'number'
-
-
-def make_regex(keyword: str):
-    return re.compile(f'^{keyword} ?(?P<{NUMBER_GROUP}>[0-9]*)$')
+LABEL_GROUP = 'label'
+
+_KEYWORD_VALUES = {
+    'oneshot': -2000000,
+    'drama cd': -1500000,
+    'extra': -1000000,
+    'extras': -1000000,
+    'omakes': -1000000,
+    'omake': -1000000,
+    'special': -500000,
+    'prologue': -100000,
+    'epilogue': 9000000,
+}
+_UNSUPPORTED_CHARS_REGEX = re.compile(r'[^\w .]')
+# classifies a cleaned label in a single match: keyword chapters (extra 2), sub chapters (24b) or any other label,
+# followed by an optional version (v2) and end marker that are ignored.
+_CHAPTER_LABEL_REGEX = re.compile(
+    '^ *(?:'
+    f'(?P<{KEYWORD_GROUP}>{"|".join(sorted(map(re.escape, _KEYWORD_VALUES), key=len, reverse=True))}) ?(?P<{NUMBER_GROUP}>[0-9]*)'
+    f'|(?P<{SUB_CHAPTER_GROUP}>[0-9]+)(?P<{LETTER_GROUP}>[a-z])'
+    f'|(?P<{LABEL_GROUP}>.*?)'
+    ') *(?:v[ .]*[0-9]+)? *(?:end)? *$')
+
+
+@lru_cache(maxsize=4096)
+def parse_chapter(label: str) -> float:
+    """ implements parsing logic for manga chapters (prologue, oneshot, 24.1, 24 etc... """
+    try:
+        return float(label)
+    except (ValueError, TypeError):
+        pass
+    if not label:
+        return float(-9000000)
+    matched = _CHAPTER_LABEL_REGEX.match(_UNSUPPORTED_CHARS_REGEX.sub('', label).lower())
+    keyword = matched.group(KEYWORD_GROUP)
+    if keyword is not None:
+        number_string = matched.group(NUMBER_GROUP)
+        return float(_KEYWORD_VALUES[keyword] + (int(number_string) if number_string else 0))
+    letter = matched.group(LETTER_GROUP)
+    if letter is not None:
+        return int(matched.group(SUB_CHAPTER_GROUP)) + (ord(letter) - ord('a') + 1)/10
+    try:
+        return float(matched.group(LABEL_GROUP))
+    except ValueError:
+        pass
+    logger.warning(f'Unsupported chapter type for comparison "{label}" ("{matched.group(LABEL_GROUP)}")')
+    return -1
+
+
+def parse_chapters(labels: Iterable[str]) -> array:
+    """ parses many chapter labels at once into a typed array of values """
+    return array('d', map(parse_chapter, labels))
 
 
 class Serializable(Generic[_SerializableClass]):
     """ abstract class """
+    __slots__ = ()
     @classmethod
     @abstractmethod
     def deserialize(cls, dict_data: Dict) -> _SerializableClass:
@@ -31,38 +87,61 @@ class UnknownChapterFormat(UserWarning):
 
 class Chapter(Serializable):
     """ represents all the logic to work with a chapter """
-    def __init__(self, chapter: str, volume: Union[None, int] = None):
-        self.volume = volume if isinstance(volume, int) else None
-        self.chapter = chapter.strip()
+    __slots__ = ('_volume', '_chapter', '_sort_key')
 
+    def __init__(self, chapter: str, volume: Union[None, int] = None):
+        self._volume = volume if isinstance(volume, int) else None
+        self._chapter = chapter.strip()
+        self._sort_key: Union[None, Tuple[float, float]] = None
+
+    @property
+    def volume(self) -> Union[None, int]:
+        """ volume is immutable as it is part of the sort key """
+        return self._volume
+
+    @property
+    def chapter(self) -> str:
+        """ chapter is immutable as it is part of the sort key """
+        return self._chapter
+
+    @staticmethod
+    def _volume_key(volume: Union[None, int]) -> float:
+        """ volumes take precedence over chapter values, chapters not in a volume yet come after all volumes """
+        return inf if volume is None else float(volume)
+
+    def sort_key(self) -> Tuple[float, float]:
+        """
+        key ordering chapters by volume and then by value, computed on first use only.
+        use it as `sorted(chapters, key=Chapter.sort_key)` rather than relying on comparison operators.
+        """
+        if self._sort_key is None:
+            self._sort_key = (self._volume_key(self._volume), parse_chapter(self._chapter))
+        return self._sort_key
+
+    # /!\ Careful you can have chap1 >= chap2 -> True and chap1 <= chap2 -> True but chap1 == chap2 false
+    # as == compares the raw chapter and volume, not the sort key
     def __ge__(self, other: 'Chapter'):
-        if self.volume is not None and other.volume is not None and self.volume != other.volume:
-            return self.volume > other.volume
-        return self.get_chapter_val() >= self.get_chapter_val()
-        # /!\ Careful you can have chap1 > chap2 -> False and chap1 >= chap2 -> True but chap1 == chap2 false
-        # as == is not used here
+        return self.sort_key() >= other.sort_key()
 
     def __gt__(self, other: 'Chapter'):
-        if self.volume is not None and other.volume is not None and self.volume != other.volume:
-            return self.volume > other.volume
-        return self.get_chapter_val() > other.get_chapter_val()
+        return self.sort_key() > other.sort_key()
 
     def __lt__(self, other: 'Chapter'):
-        return not self.__ge__(other)
+        return self.sort_key() < other.sort_key()
 
     def __le__(self, other: 'Chapter'):
-        return not self.__gt__(other)
+        return self.sort_key() <= other.sort_key()
 
     def __eq__(self, other: 'Chapter'):
-        if self.volume != other.volume:
+        if self._volume != other.volume:
             return False
-        return self.chapter == other.chapter
+        return self._chapter == other.chapter
 
     def __ne__(self, other: 'Chapter'):
         return not self.__eq__(other)
 
     def __hash__(self) -> int:
-        return hash((self.volume, self.chapter))
+        return hash((self._volume, self._chapter))
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -73,55 +152,15 @@ class Chapter(Serializable):
         fromated_value = re.sub(r'\.0+', '', fromated_value)
         return f'volume: {self.volume}, \tchapter: "{self.chapter}" (value: {fromated_value})'
 
-    regex_values_mapping = [
-        (-2000000, make_regex('oneshot')),
-        (-1500000, make_regex('drama cd')),
-        (-1000000, make_regex('extra')),
-        (-1000000, make_regex('extras')),
-        (-1000000, make_regex('omakes')),
-        (-1000000, make_regex('omake')),
-        (-500000, make_regex('special')),
-        (-100000, make_regex('prologue')),
-        (9000000, make_regex('epilogue')),
-    ]
-
-    unsupported_chars_regex = re.compile('[^\w .]')
-    version_regex = re.compile(f'v[ .]*[0-9]+$')
-    end_regex = re.compile(f'end$')
-    sub_chapter_letter = re.compile(f'^(?P<{NUMBER_GROUP}>[0-9]+)(?P<{LETTER_GROUP}>[a-z])$')
-
     def get_chapter_val(self) -> float:
-        """ implements parsing logic for manga chapters (prologue, oneshot, 24.1, 24 etc... """
-        try:
-            return float(self.chapter)
-        except (ValueError, TypeError):
-            pass
-        if not self.chapter:
-            return float(-9000000)
-        attached_string_chapter = self.unsupported_chars_regex.sub('', self.chapter).lower().strip()
-        attached_string_chapter = self.end_regex.sub('', attached_string_chapter).strip()
-        attached_string_chapter = self.version_regex.sub('', attached_string_chapter).strip()
-        for value, regexp in self.regex_values_mapping:
-            matched = regexp.match(attached_string_chapter)
-            if not matched:
-                continue
-            number_string = matched.group(NUMBER_GROUP)
-            if not number_string:
-                return float(value)
-            sub_info = int(number_string)
-            return float(value + sub_info)
-        sub_chapter_matched = self.sub_chapter_letter.match(attached_string_chapter)
-        if sub_chapter_matched:
-            sub_version = ord(sub_chapter_matched.group(LETTER_GROUP)) - ord('a') + 1
-            chapter_num = int(sub_chapter_matched.group(NUMBER_GROUP))
-            return chapter_num + sub_version/10
-        try:
-            return float(attached_string_chapter)
-        except (ValueError, TypeError):
-            pass
-        logger.warning(f'Unsupported chapter type for comparison "{self.chapter}" '
-                       f'(volume {self.volume} - "{attached_string_chapter}")')
-        return -1
+        """ value of the chapter used for ordering """
+        return self.sort_key()[1]
+
+    @staticmethod
+    def prime_sort_keys(chapters: Sequence['Chapter']) -> None:
+        """ computes the sort keys of many chapters at once with a single batch parse """
+        for chapter, value in zip(chapters, parse_chapters(chapter.chapter for chapter in chapters)):
+            chapter._sort_key = (chapter._volume_key(chapter.volume), value)
 
     def is_valid(self) -> bool:
         """ whether the current chapter can be given an acceptable value or has a default one"""
@@ -145,3 +184,21 @@ class Chapter(Serializable):
         if 'volume' in dict_data:
             dict_data['volume'] = int(dict_data['volume'])
         return cls(**dict_data)
+
+
+def pack_chapters(chapters: Iterable[Chapter]) -> bytes:
+    """ compact encoding of chapters for storage: compressed columns of volumes and chapters """
+    volumes, labels = [], []
+    for chapter in chapters:
+        volumes.append(chapter.volume)
+        labels.append(chapter.chapter)
+    return zlib.compress(json.dumps([volumes, labels], separators=(',', ':')).encode('utf8'))
+
+
+def unpack_chapters(packed_chapters: bytes) -> List[Chapter]:
+    """ inverse of pack_chapters. raises ValueError if the data was not created by pack_chapters """
+    try:
+        volumes, labels = json.loads(zlib.decompress(packed_chapters).decode('utf8'))
+    except zlib.error as e:
+        raise ValueError(f'Chapters could not be decompressed: {e}')
+    return [Chapter(label, volume) for volume, label in zip(volumes, labels)]
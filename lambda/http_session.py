@@ -0,0 +1,88 @@
+import threading
+from typing import Union, Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_POOL_SIZE, HTTP_CACHE_DIR, HTTP_CACHE_MAX_ENTRIES
+from disk_store import DiskStore
+
+_CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+_session: Union[None, requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """ shared session keeping connections alive across calls (and threads) """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+                _session = session
+    return _session
+
+
+class ResponseCache:
+    """ small on disk cache of validated responses, used to send conditional requests """
+
+    def __init__(self, directory: str, max_entries: int):
+        self._store = DiskStore(directory, max_entries)
+
+    def get(self, url: str) -> Union[None, Dict[str, Any]]:
+        """ returns the cached headers and content for the url or None if absent """
+        stored = self._store.get(url)
+        return None if stored is None else stored[1]
+
+    def put(self, url: str, response: requests.Response) -> None:
+        """ stores the response if it carries a validator """
+        headers = {header: response.headers[header] for header in _CACHED_HEADERS if header in response.headers}
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return
+        self._store.put(url, dict(headers=headers, content=response.content))
+
+
+response_cache = ResponseCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_ENTRIES)
+
+
+def _response_from_cache(url: str, entry: Dict[str, Any]) -> requests.Response:
+    """ rebuilds a 200 response from a cached entry after a 304 """
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers.update(entry['headers'])
+    response._content = entry['content']
+    return response
+
+
+def get(url: str, conditional: bool = False, **kwargs) -> requests.Response:
+    """
+    GET through the shared session.
+    When conditional, sends If-None-Match/If-Modified-Since from the cached response and serves it back on a 304.
+    """
+    session = get_session()
+    if not conditional:
+        return session.get(url, **kwargs)
+    cached_entry = response_cache.get(url)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if cached_entry is not None:
+        if 'ETag' in cached_entry['headers']:
+            headers['If-None-Match'] = cached_entry['headers']['ETag']
+        if 'Last-Modified' in cached_entry['headers']:
+            headers['If-Modified-Since'] = cached_entry['headers']['Last-Modified']
+    response = session.get(url, headers=headers, **kwargs)
+    if response.status_code == 304 and cached_entry is not None:
+        return _response_from_cache(url, cached_entry)
+    if response.status_code == 200:
+        response_cache.put(url, response)
+    return response
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """ POST through the shared session """
+    return get_session().post(url, **kwargs)
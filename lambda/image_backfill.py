@@ -0,0 +1,54 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+from typing import Tuple
+
+import click
+from PIL import Image
+
+import page_marks_db
+from config import IMAGE_BACKFILL_CONCURRENCY
+from img_hosting import expose_image, expose_variants, get_hosted_image
+from lookup_cache import lookup_cache, get_serie_info, get_image
+
+
+def backfill_image(serie_id: str) -> bool:
+    """
+    hosts the variants of the cover already hosted for the serie, which may be a custom one, leaving it as is.
+    the cover of series without hosted cover is fetched from mangaupdates. returns whether anything was uploaded
+    """
+    hosted_image = get_hosted_image(serie_id)
+    if hosted_image is not None:
+        return expose_variants(serie_id=serie_id, content=hosted_image)
+    serie = get_serie_info(int(serie_id))
+    image = Image.open(io.BytesIO(get_image(serie.img_url)))
+    return expose_image(serie_id=serie_id, image=image)
+
+
+@click.command()
+@click.argument('serie_ids', nargs=-1)
+@click.option('--concurrency', default=IMAGE_BACKFILL_CONCURRENCY, help='Number of covers processed in parallel.')
+@click.option('--cache/--no-cache', default=True, help='Whether to reuse the series and images looked up recently.')
+def backfill_images(serie_ids: Tuple[str, ...], concurrency: int, cache: bool):
+    """
+    called only in local for admin tasks: hosts the variants of the covers of the given series, or of all the series
+    in db, from their hosted covers
+    """
+    lookup_cache.bypass = not cache
+    if not serie_ids:
+        serie_ids = tuple(page_mark.serie_id for page_mark in page_marks_db.get_all(use_cache=False))
+    outcomes = Counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(backfill_image, serie_id): serie_id for serie_id in serie_ids}
+        for future in as_completed(futures):
+            try:
+                outcomes['uploaded' if future.result() else 'unchanged'] += 1
+            except Exception as e:
+                outcomes['failed'] += 1
+                click.echo(f"Serie {futures[future]} failed: {e}")
+    click.echo(f"{len(serie_ids)} series: " + ', '.join(f'{outcome} {number}' for outcome, number in outcomes.items()))
+
+
+if __name__ == "__main__":
+    ## called only in local for admin tasks
+    backfill_images()
@@ -1,66 +1,216 @@
+import base64
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hashlib
+import io
+from math import ceil
 import os
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, Union
 
-import boto3
-from botocore.signers import CloudFrontSigner
-import rsa
-
-from config import CLOUD_FRONT_SECRET_KEY, EMAIL_VALIDITY
+from config import CLOUD_FRONT_SECRET_KEY, EMAIL_VALIDITY, SIGNED_URL_WINDOW, CLOUD_FRONT_WILDCARD_POLICY
 from utils import encode_in_base64
 
+if TYPE_CHECKING:
+    from botocore.signers import CloudFrontSigner
+    import rsa
+
 IMG_FORMAT = "webp"
+# width of the variants of the covers, thumb is the max-width of the covers in the mail template
+IMG_VARIANT_WIDTHS = {"thumb": 231, "2x": 462}
 
-def rsa_signer(message):
+
+@lru_cache(maxsize=None)
+def _load_private_key() -> 'rsa.PrivateKey':
+    """ the key is read and parsed once per process """
+    import rsa
     with open(CLOUD_FRONT_SECRET_KEY, 'rb') as f:
-        key = f.read()
+        return rsa.PrivateKey.load_pkcs1(f.read())
+
+
+def rsa_signer(message):
+    import rsa
     return rsa.sign(
         message,
-        rsa.PrivateKey.load_pkcs1(key),
+        _load_private_key(),
         'SHA-1')
 
 
-cloudfront_signer = CloudFrontSigner(os.getenv("CLOUD_FRONT_KEY_ID", ""), rsa_signer)
+CLOUD_FRONT_KEY_ID = os.getenv("CLOUD_FRONT_KEY_ID", "")
 BUCKET = "manga-scraping-img"
 S3_REGION = "eu-west-1"  # Must correspond to terraform provider region!
+CONTENT_HASH_METADATA = "sha256"  # user metadata of the hosted images, to skip uploading them again
+
+# signed urls of the current validity window, by serie id (or "*" for the wildcard policy query string)
+_signed_urls_window: Union[None, datetime] = None
+_signed_urls: Dict[str, str] = dict()
+
+
+@lru_cache(maxsize=None)
+def _get_cloudfront_signer() -> 'CloudFrontSigner':
+    from botocore.signers import CloudFrontSigner
+    return CloudFrontSigner(CLOUD_FRONT_KEY_ID, rsa_signer)
+
+
+def _get_expiry() -> datetime:
+    """ end of the validity of urls signed now, rounded up to SIGNED_URL_WINDOW so that they can be reused """
+    expiry = (datetime.now() + timedelta(days=EMAIL_VALIDITY)).timestamp()
+    return datetime.fromtimestamp(ceil(expiry / SIGNED_URL_WINDOW) * SIGNED_URL_WINDOW)
+
 
+def _get_signed_urls(expiry: datetime) -> Dict[str, str]:
+    """ signed urls cached for the validity window, older ones are dropped """
+    global _signed_urls_window, _signed_urls
+    if _signed_urls_window != expiry:
+        _signed_urls_window = expiry
+        _signed_urls = dict()
+    return _signed_urls
 
-def build_serie_img_viewer_url(serie_id: str) -> str:
-    """ build the image full path for html creation """
+
+def _url_b64encode(data: bytes) -> str:
+    """ url safe base 64 as expected by cloudfront """
+    return base64.b64encode(data).replace(b'+', b'-').replace(b'=', b'_').replace(b'/', b'~').decode('utf8')
+
+
+def _build_policy_query_string(resource: str, expiry: datetime) -> str:
+    """ signs a custom policy allowing the urls matching resource, which may contain wildcards, until expiry """
+    policy = _get_cloudfront_signer().build_policy(resource, date_less_than=expiry).encode('utf8')
+    return f"Policy={_url_b64encode(policy)}" \
+           f"&Signature={_url_b64encode(rsa_signer(policy))}" \
+           f"&Key-Pair-Id={CLOUD_FRONT_KEY_ID}"
+
+
+def build_serie_img_viewer_url(serie_id: str, variant: Union[None, str] = None) -> str:
+    """ build the image full path for html creation, of the original image or of one of its variants """
     cdn_domain = os.getenv("CLOUD_FRONT_DISTRIBUTION_DOMAIN")
     if cdn_domain is None:
         raise EnvironmentError(f'Cloud front distribution not found when dealing with serie {serie_id}')
-    path = build_url_path(serie_id)
+    path = build_url_path(serie_id, variant)
     url = f"https://{cdn_domain}/{path}"
-    return cloudfront_signer.generate_presigned_url(
-        url=url, date_less_than=datetime.now() + timedelta(days=EMAIL_VALIDITY))
+    expiry = _get_expiry()
+    signed_urls = _get_signed_urls(expiry)
+    if CLOUD_FRONT_WILDCARD_POLICY:
+        if "*" not in signed_urls:
+            signed_urls["*"] = _build_policy_query_string(f"https://{cdn_domain}/*", expiry)
+        return f"{url}?{signed_urls['*']}"
+    if variant is not None:
+        # a single signature per serie is shared by all its variants
+        variants_resource = f"https://{cdn_domain}/{build_url_path(serie_id, '*')}"
+        if variants_resource not in signed_urls:
+            signed_urls[variants_resource] = _build_policy_query_string(variants_resource, expiry)
+        return f"{url}?{signed_urls[variants_resource]}"
+    if serie_id not in signed_urls:
+        signed_urls[serie_id] = _get_cloudfront_signer().generate_presigned_url(url=url, date_less_than=expiry)
+    return signed_urls[serie_id]
+
+
+def build_url_path(serie_id: str, variant: Union[None, str] = None):
+    """ build the relative path to the serie image, or to one of its variants """
+    if variant is None:
+        return f"i{encode_in_base64(serie_id)}.{IMG_FORMAT}"
+    return f"i{encode_in_base64(serie_id)}-{variant}.{IMG_FORMAT}"
+
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 
-def build_url_path(serie_id: str):
-    """ build the relative path to the serie """
-    return f"i{encode_in_base64(serie_id)}.{IMG_FORMAT}"
+@lru_cache(maxsize=None)
+def _get_s3_client():
+    """ created on first use then shared, clients are thread safe """
+    import boto3
+    return boto3.client("s3", region_name=S3_REGION)
 
 
-if TYPE_CHECKING:
+def encode_image(image: "Image") -> bytes:
+    """ encodes the image as hosted, in memory """
+    buffer = io.BytesIO()
+    image.save(buffer, IMG_FORMAT, quality=50)
+    return buffer.getvalue()
+
+
+def encode_variants(image: "Image", original: Union[None, bytes] = None) -> Dict[Union[None, str], bytes]:
+    """
+    encodes the original image and its variants by variant name, from a single decode of the image.
+    original is the image already encoded as hosted, kept as is when given
+    """
     from PIL import Image
+    rgb_image = image.convert("RGB")
+    if original is None:
+        original = encode_image(rgb_image)
+    encoded_variants: Dict[Union[None, str], bytes] = {None: original}
+    for variant, width in IMG_VARIANT_WIDTHS.items():
+        if rgb_image.width > width:
+            variant_image = rgb_image.resize((width, max(1, round(rgb_image.height * width / rgb_image.width))),
+                                             Image.LANCZOS)
+            encoded_variants[variant] = encode_image(variant_image)
+        else:
+            # images are not enlarged
+            encoded_variants[variant] = encoded_variants[None]
+    return encoded_variants
+
+
+def get_hosted_image(serie_id: str) -> Union[None, bytes]:
+    """ the original image hosted for the serie, as encoded on the bucket, None if absent """
+    from botocore.exceptions import ClientError
+    try:
+        response = _get_s3_client().get_object(Bucket=BUCKET, Key=build_url_path(serie_id))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return response['Body'].read()
 
 
-def expose_image(serie_id: str, image: "Image") -> None:
-    """ host the image on the bucket exposed via the cdn """
-    image_file_path = f"/tmp/manga_scrapping_{serie_id}.webp"
-    image.convert("RGB").save(image_file_path, "webp", quality=50)
+def _get_hosted_hash(key: str) -> Union[None, str]:
+    """ content hash of the object stored at key, None if absent or uploaded without hash """
+    from botocore.exceptions import ClientError
     try:
-        s3_client = boto3.client("s3")
-        s3_client.upload_file(Filename=image_file_path,
-                              Bucket=BUCKET,
-                              Key=build_url_path(serie_id))
-    finally:
-        os.remove(image_file_path)
+        response = _get_s3_client().head_object(Bucket=BUCKET, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return response.get('Metadata', {}).get(CONTENT_HASH_METADATA)
+
+
+def _upload(key: str, content: bytes) -> bool:
+    """ uploads the content unless the same content is already stored at key, returns whether it was uploaded """
+    content_hash = hashlib.sha256(content).hexdigest()
+    if _get_hosted_hash(key) == content_hash:
+        return False
+    _get_s3_client().put_object(Bucket=BUCKET,
+                                Key=key,
+                                Body=content,
+                                ContentType=f"image/{IMG_FORMAT}",
+                                Metadata={CONTENT_HASH_METADATA: content_hash})
+    return True
+
+
+def expose_image(serie_id: str, image: "Image") -> bool:
+    """
+    host the image and its variants on the bucket exposed via the cdn.
+    returns False when the same images were already hosted
+    """
+    uploaded = [_upload(build_url_path(serie_id, variant), content)
+                for variant, content in encode_variants(image).items()]
+    return any(uploaded)
+
+
+def expose_variants(serie_id: str, content: bytes) -> bool:
+    """
+    host the variants of the hosted original image, given as encoded on the bucket, the original being left as is.
+    returns False when the same variants were already hosted
+    """
+    from PIL import Image
+    variants = encode_variants(Image.open(io.BytesIO(content)), original=content)
+    uploaded = [_upload(build_url_path(serie_id, variant), variant_content)
+                for variant, variant_content in variants.items() if variant is not None]
+    return any(uploaded)
 
 
 def delete_image(serie_id: str) -> None:
-    """ delete the image on the bucket """
-    s3_client = boto3.client("s3")
-    s3_client.delete_object(
-        Bucket=BUCKET,
-        Key=build_url_path(serie_id))
+    """ delete the image and its variants on the bucket """
+    for variant in [None, *IMG_VARIANT_WIDTHS]:
+        _get_s3_client().delete_object(
+            Bucket=BUCKET,
+            Key=build_url_path(serie_id, variant))
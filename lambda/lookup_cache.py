@@ -0,0 +1,52 @@
+"""
+On disk cache of the mangaupdates lookups of the admin tools, which repeat them while the operator goes through
+the candidates of a search. Entries expire after a ttl, the least recently used ones are evicted above a number of
+entries. Not used by the lambda, whose lookups must be fresh.
+"""
+from functools import wraps
+import time
+from typing import Any, Callable
+
+import mangaupdate_srv
+from config import LOOKUP_CACHE_DIR, LOOKUP_CACHE_TTL, LOOKUP_CACHE_MAX_ENTRIES
+from disk_store import DiskStore
+
+_MISSING = object()
+
+
+class LookupCache:
+    """ results by call """
+
+    def __init__(self, directory: str, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.bypass = False  # results are then always looked up again, and stored
+        self._store = DiskStore(directory, max_entries)
+
+    def get(self, key: str) -> Any:
+        """ returns the value stored for key, or _MISSING if absent or expired """
+        stored = self._store.get(key)
+        if stored is None or time.time() - stored[0] > self.ttl:
+            return _MISSING
+        return stored[1]
+
+    def put(self, key: str, value: Any) -> None:
+        self._store.put(key, value)
+
+    def cached(self, function: Callable) -> Callable:
+        """ caches the results of function by arguments, which must have a stable repr """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = repr((function.__module__, function.__qualname__, args, sorted(kwargs.items())))
+            value = _MISSING if self.bypass else self.get(key)
+            if value is _MISSING:
+                value = function(*args, **kwargs)
+                self.put(key, value)
+            return value
+        return wrapper
+
+
+lookup_cache = LookupCache(LOOKUP_CACHE_DIR, LOOKUP_CACHE_TTL, LOOKUP_CACHE_MAX_ENTRIES)
+
+search_series = lookup_cache.cached(mangaupdate_srv.search_series)
+get_serie_info = lookup_cache.cached(mangaupdate_srv.get_serie_info)
+get_image = lookup_cache.cached(mangaupdate_srv.get_image)
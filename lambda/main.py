@@ -1,44 +1,127 @@
 import logging
-from datetime import datetime, timedelta
-from typing import List
+from datetime import datetime, timedelta, date
+from itertools import chain
+from typing import List, Dict, Tuple, Iterable, Set
 
 import pytz
 
 import emailing
 import page_marks_db
 import release_formating
+from config import RELEASE_CURSOR_OVERLAP_DAYS
 from logs import logger
-from mangaupdate_srv import get_releases
+from metrics import metrics
+from mangaupdate_srv import iter_releases, iter_release_pages, release_count
+from releases_types import ReleaseCursor, SerieReleases
+
+
+def _load_watched_releases(until: date, release_cursor: ReleaseCursor)\
+        -> Tuple[Dict[str, page_marks_db.PageMark], int, Iterable[SerieReleases]]:
+    """
+    loads the page marks with the cheapest strategy: from cache, by scan or by keys of the series in the releases.
+    returns the page marks by serie id, the number of watched series and the releases of the watched series,
+    the page marks read by keys being added to the map while the releases are iterated.
+    """
+    with metrics.span('LoadPageMarks'):
+        all_page_marks = page_marks_db.get_cached()
+    if all_page_marks is not None:
+        metrics.count('PageMarksCacheHits')
+        page_marks_map = {pm.serie_id: pm for pm in all_page_marks}
+        return (page_marks_map,
+                len(all_page_marks),
+                iter_releases(until, cursor=release_cursor, watched_series_ids=page_marks_map.keys()))
+    # the size of the feed, told by its first page, bounds the number of series to read by keys.
+    # the following pages are fetched meanwhile
+    release_pages = iter_release_pages()
+    first_page = next(release_pages)
+    release_pages = chain([first_page], release_pages)
+    with metrics.span('LoadPageMarks'):
+        serie_number = page_marks_db.get_page_mark_count()
+        release_number = release_count(first_page[1])
+        item_count, table_size = page_marks_db.estimate_table()
+        keyed_fetch = serie_number is not None and release_number is not None \
+            and page_marks_db.keyed_fetch_is_cheaper(release_number, item_count, table_size)
+        if not keyed_fetch:
+            all_page_marks = page_marks_db.get_all()
+            page_marks_map = {pm.serie_id: pm for pm in all_page_marks}
+            return (page_marks_map,
+                    len(all_page_marks),
+                    iter_releases(until, cursor=release_cursor, watched_series_ids=page_marks_map.keys(),
+                                  release_pages=release_pages))
+    logger.info(f'Getting page marks of the series released in {release_number} releases out of {serie_number}.')
+    page_marks_map = {}
+
+    def watch_series(serie_ids: Set[str]) -> List[str]:
+        with metrics.span('LoadPageMarks'):
+            page_marks = page_marks_db.get_many(serie_ids)
+        page_marks_map.update((pm.serie_id, pm) for pm in page_marks)
+        return [pm.serie_id for pm in page_marks]
+
+    return (page_marks_map,
+            serie_number,
+            iter_releases(until, cursor=release_cursor, watched_series_ids=(), release_pages=release_pages,
+                          watch_series=watch_series))
 
 
 def handle_scheduled_scraping(event, context):
-    """ main function on lambda. """
+    """ main function on lambda. metrics of the run are logged in cloudwatch embedded metric format """
+    metrics.reset()
+    try:
+        with metrics.span('Handler'):
+            _scrape_and_send()
+    finally:
+        metrics.flush()
+
+
+def _scrape_and_send():
     # scraping
-    all_page_marks = page_marks_db.get_all()
-    page_marks_map = {pm.serie_id: pm for pm in all_page_marks}
-    # sort to update first the oldest values and then the most recent.
-    all_series_releases = get_releases((datetime.now() - timedelta(days=2)).date())
-    logger.info(f'Got info for all series.')
-    updated_serie_releases: List[release_formating.FormattedSerieReleases] = []
-    for serie_releases in all_series_releases:
+    with metrics.span('LoadCursor'):
+        release_cursor = page_marks_db.get_release_cursor()
+    until = release_cursor.until(overlap_days=RELEASE_CURSOR_OVERLAP_DAYS,
+                                 default=(datetime.now() - timedelta(days=2)).date())
+    logger.info(f'{release_cursor}, getting releases until {until}')
+    page_marks_map, serie_number, watched_releases = _load_watched_releases(until, release_cursor)
+    metrics.count('WatchedSeries', serie_number)
+    updated_releases_map: Dict[str, release_formating.FormattedSerieReleases] = {}
+    # releases are formatted page after page while the next pages are being fetched
+    for serie_releases in watched_releases:
         if serie_releases.serie_id not in page_marks_map:
             logger.info(f"skipping {serie_releases} as it is not watched")
             continue
-        formatted_scrapped_releases = release_formating.format_new_releases(
-            serie_releases=serie_releases,
-            serie_page_mark=page_marks_map[serie_releases.serie_id],
-        )
-        if formatted_scrapped_releases.releases:
-            updated_serie_releases.append(formatted_scrapped_releases)
-        else:
+        with metrics.span('FormatReleases'):
+            formatted_scrapped_releases = release_formating.format_new_releases(
+                serie_releases=serie_releases,
+                serie_page_mark=page_marks_map[serie_releases.serie_id],
+            )
+        if not formatted_scrapped_releases.releases:
             logger.info(f"Skipping {serie_releases} as it has already been reported.")
+        elif serie_releases.serie_id in updated_releases_map:
+            updated_releases_map[serie_releases.serie_id].extend(formatted_scrapped_releases)
+        else:
+            updated_releases_map[serie_releases.serie_id] = formatted_scrapped_releases
+    release_cursor.prune(overlap_days=RELEASE_CURSOR_OVERLAP_DAYS)
+    logger.info(f'Got info for all series.')
+    updated_serie_releases: List[release_formating.FormattedSerieReleases] = list(updated_releases_map.values())
+    metrics.count('SeriesUpdated', len(updated_serie_releases))
+    metrics.count('ReleasesReported', sum(len(releases.releases) for releases in updated_serie_releases))
     # send email
-    html_mail = emailing.helper.build_html_body(updated_serie_releases, len(all_page_marks))
-    txt_mail = emailing.helper.build_txt_body(updated_serie_releases)
-    emailing.helper.send_newsletter(text_body=txt_mail, html_body=html_mail)
+    with metrics.span('LoadSubscribers'):
+        subscribers = page_marks_db.get_subscribers()
+    metrics.count('Subscribers', len(subscribers))
+    if subscribers:
+        emailing.fan_out.send_newsletters(updated_serie_releases, subscribers)
+    else:
+        # without subscribers, the newsletter of every watched serie goes to the receiving emails
+        with metrics.span('RenderEmail'):
+            html_mail = emailing.helper.build_html_body(updated_serie_releases, serie_number)
+            txt_mail = emailing.helper.build_txt_body(updated_serie_releases)
+        with metrics.span('SendEmail'):
+            emailing.helper.send_newsletter(text_body=txt_mail, html_body=html_mail)
 
     if not updated_serie_releases:
         logger.info('nothing to store. Stopping lambda.')
+        with metrics.span('SavePageMarks'):
+            page_marks_db.put_release_cursor(release_cursor)
         return
     all_releases = '\n'.join(sorted([f'\t{r.serie_id}, {r.serie_title}' for r in updated_serie_releases]))
     logger.info(f'Finaly over, registering : \n{all_releases}')
@@ -55,4 +138,8 @@ def handle_scheduled_scraping(event, context):
         page_mark.latest_update = datetime.utcnow()
         page_mark.latest_update.replace(tzinfo=pytz.utc)
 
-    page_marks_db.batch_put(all_page_marks)
+    with metrics.span('SavePageMarks'):
+        written_count = page_marks_db.save_modified(page_marks_map.values())
+        page_marks_db.put_release_cursor(release_cursor)
+    metrics.count('PageMarksWritten', written_count)
+    logger.info(f'{written_count} page marks written.')
@@ -1,68 +1,201 @@
-from datetime import date, datetime
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from functools import wraps
+from itertools import count
 import urllib.parse
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Iterator, Tuple, Deque, Union, Iterable, Callable
 
-import backoff
 import requests
 
+import http_session
+from config import RELEASES_FETCH_CONCURRENCY, MANGAUPDATES_API_URL
+from global_types import Chapter
 from logs import logger
-from releases_types import SerieReleases, ChapterRelease, Serie
+from metrics import metrics
+from releases_types import SerieReleases, ChapterRelease, Serie, ReleaseCursor
 
 
-@backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3)
+def _retry_on_http_error(function):
+    """ backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3), with backoff imported on first call """
+    retried_function = None
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        nonlocal retried_function
+        if retried_function is None:
+            import backoff
+            retried_function = backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3)(function)
+        return retried_function(*args, **kwargs)
+    return wrapper
+
+
+@_retry_on_http_error
 def _request_mangaupdate(page: int = 0) -> dict:
-    requested_url = "https://api.mangaupdates.com/v1/releases/days"
+    requested_url = f"{MANGAUPDATES_API_URL}/releases/days"
     params = dict(include_metadata=True)
     if page != 0:
         params.update(page=page)
     requested_url += "?" + urllib.parse.urlencode(params)
-    response = requests.get(requested_url)
+    response = http_session.get(requested_url)
     response.raise_for_status()
     return response.json()
 
 
-def get_releases(until: date) -> List[SerieReleases]:
-    """retrieves all the releases until a given date"""
-    page = 0
-    chapters_per_series: Dict[int, Set[ChapterRelease]] = defaultdict(set)
-    while True:
-        page_results = _request_mangaupdate(page=page)
+def iter_release_pages(concurrency: int = RELEASES_FETCH_CONCURRENCY) -> Iterator[Tuple[int, dict]]:
+    """ yields release pages in order while keeping up to `concurrency` page requests in flight """
+    if concurrency <= 1:
+        for page in count():
+            with metrics.span('FetchReleases'):
+                page_results = _request_mangaupdate(page=page)
+            yield page, page_results
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending_pages: Deque[Tuple[int, Future]] = deque()
+        next_pages = count()
         try:
-            page_results = page_results["results"]
-        except KeyError:
-            logger.error(f"Unexpected page format on page {page}: {page_results}")
-            raise
+            while True:
+                while len(pending_pages) < concurrency:
+                    page = next(next_pages)
+                    pending_pages.append((page, executor.submit(_request_mangaupdate, page=page)))
+                page, page_future = pending_pages.popleft()
+                # time spent waiting for the page, the following ones being fetched meanwhile
+                with metrics.span('FetchReleases'):
+                    page_results = page_future.result()
+                yield page, page_results
+        finally:
+            # pages requested past `until` are never read
+            for _, page_future in pending_pages:
+                page_future.cancel()
+
+
+def _page_records(page: int, page_results: dict) -> List[dict]:
+    try:
+        return page_results["results"]
+    except KeyError:
+        logger.error(f"Unexpected page format on page {page}: {page_results}")
+        raise
+
+
+def _record_fields(page: int, record: dict) -> Tuple[int, dict, str]:
+    """ serie id, chapter data and release date of a record of the feed """
+    try:
+        return record["metadata"]["series"]["series_id"], record['record'], record['record']["release_date"]
+    except (KeyError, TypeError):
+        logger.error(f"Unexpected record format on page {page}: {record}")
+        raise
+
 
-        min_release_dates = None
-        for record in page_results:
+def _is_last_page(page: int, records: List[dict], until_date: str) -> bool:
+    """ whether the page is empty or reaches releases older than until_date """
+    if not records:
+        return True
+    min_release_date = min(_record_fields(page, record)[2] for record in records)
+    try:
+        date.fromisoformat(min_release_date)
+    except (TypeError, ValueError):
+        logger.error(f"Unexpected release date format on page {page}: {min_release_date}")
+        raise
+    return min_release_date < until_date
+
+
+def _released_serie_ids(page: int,
+                        records: List[dict],
+                        until_date: str,
+                        cursor: Union[ReleaseCursor, None]) -> Set[int]:
+    """ ids of the series with records until a given date that the cursor does not hold, the cursor is not changed """
+    serie_ids = set()
+    for record in records:
+        series_id, chapter_data, release_date = _record_fields(page, record)
+        if release_date >= until_date and \
+                (cursor is None or not cursor.is_processed(release_date, chapter_data.get("id"))):
+            serie_ids.add(series_id)
+    return serie_ids
+
+
+def release_count(page_results: dict) -> Union[None, int]:
+    """ number of records of the whole feed as told by any of its pages, None when the page does not tell """
+    total_hits = page_results.get("total_hits")
+    return None if total_hits is None else int(total_hits)
+
+
+def iter_releases(until: date,
+                  concurrency: int = RELEASES_FETCH_CONCURRENCY,
+                  cursor: Union[ReleaseCursor, None] = None,
+                  watched_series_ids: Union[Iterable[str], None] = None,
+                  release_pages: Union[Iterable[Tuple[int, dict]], None] = None,
+                  watch_series: Union[Callable[[Set[str]], Iterable[str]], None] = None) -> Iterator[SerieReleases]:
+    """
+    yields the releases until a given date page after page: a serie is yielded once for every page it appears on.
+    When a cursor is given, records it already holds are skipped and the new ones are added to it. Paging still goes
+    down to the date, so that releases indexed late within the overlap of the cursor are read.
+    When watched series ids are given, the releases of any other serie are dropped before being parsed.
+    watch_series is then called on every page with the ids of its released series that are not watched yet, and
+    returns the ones to watch from this page on.
+    Pages already requested with iter_release_pages can be given instead of being requested again.
+    """
+    # release dates are iso formatted in the feed: they are compared as strings to avoid parsing them
+    until_date = until.isoformat()
+    watched_ids = None if watched_series_ids is None else {int(serie_id) for serie_id in watched_series_ids}
+    unwatched_ids: Set[int] = set()
+    if release_pages is None:
+        release_pages = iter_release_pages(concurrency)
+    for page, page_results in release_pages:
+        chapters_per_series: Dict[int, Set[ChapterRelease]] = defaultdict(set)
+        records = _page_records(page, page_results)
+        metrics.count('ReleasePagesFetched')
+        metrics.count('ReleaseRecordsParsed', len(records))
+        if watched_ids is not None and watch_series is not None:
+            new_ids = _released_serie_ids(page, records, until_date, cursor) - watched_ids - unwatched_ids
+            if new_ids:
+                newly_watched_ids = {int(serie_id) for serie_id in watch_series({str(i) for i in new_ids})}
+                watched_ids.update(newly_watched_ids)
+                unwatched_ids.update(new_ids - newly_watched_ids)
+        kept_records = 0
+        for record in records:
+            series_id, chapter_data, release_date = _record_fields(page, record)
+            if release_date < until_date or (watched_ids is not None and series_id not in watched_ids):
+                continue
+            if cursor is not None:
+                if cursor.is_processed(release_date, chapter_data.get("id")):
+                    continue
+                cursor.add(release_date, chapter_data.get("id"))
             try:
-                series_id = record["metadata"]["series"]["series_id"]
-                chapter_data = record['record']
                 chapter_release = ChapterRelease(
                     group=chapter_data["groups"][0]['name'],  # todo: get name of all groups
                     volume=chapter_data["volume"],
                     chapter=chapter_data["chapter"] if chapter_data["chapter"] is not None else '.',
                 )
-                release_date = datetime.strptime(chapter_data["release_date"], "%Y-%m-%d").date()
-            except (KeyError, IndexError, ValueError):
+            except (KeyError, IndexError):
                 logger.error(f"Unexpected record format on page {page}: {record}")
                 raise
-            if min_release_dates is None or release_date < min_release_dates:
-                min_release_dates = release_date
-            if release_date >= until:
-                chapters_per_series[series_id].add(chapter_release)
-        if min_release_dates < until or min_release_dates is None:
+            chapters_per_series[series_id].add(chapter_release)
+            kept_records += 1
+        metrics.count('ReleaseRecordsKept', kept_records)
+        Chapter.prime_sort_keys([chapter for chapters in chapters_per_series.values() for chapter in chapters])
+        for series_id, chapters in chapters_per_series.items():
+            yield SerieReleases(serie_id=str(series_id), chapters_releases=chapters)
+        if _is_last_page(page, records, until_date):
             break
-        page += 1
-    return [SerieReleases(serie_id=str(series_id), chapters_releases=list(chapters))
-            for series_id, chapters in chapters_per_series.items()]
 
 
-@backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3)
+def get_releases(until: date,
+                 concurrency: int = RELEASES_FETCH_CONCURRENCY,
+                 cursor: Union[ReleaseCursor, None] = None,
+                 watched_series_ids: Union[Iterable[str], None] = None,
+                 release_pages: Union[Iterable[Tuple[int, dict]], None] = None,
+                 watch_series: Union[Callable[[Set[str]], Iterable[str]], None] = None) -> List[SerieReleases]:
+    """retrieves all the releases until a given date (see iter_releases)"""
+    chapters_per_series: Dict[str, Set[ChapterRelease]] = defaultdict(set)
+    for serie_releases in iter_releases(until, concurrency, cursor, watched_series_ids, release_pages, watch_series):
+        chapters_per_series[serie_releases.serie_id].update(serie_releases)
+    return [SerieReleases(serie_id=serie_id, chapters_releases=list(chapters))
+            for serie_id, chapters in chapters_per_series.items()]
+
+
+@_retry_on_http_error
 def _request_serie(serie_id: int) -> dict:
-    requested_url = f"https://api.mangaupdates.com/v1/series/{serie_id}"
-    response = requests.get(requested_url)
+    requested_url = f"{MANGAUPDATES_API_URL}/series/{serie_id}"
+    response = http_session.get(requested_url, conditional=True)
     if response.status_code != 404:
         response.raise_for_status()
     else:
@@ -83,11 +216,11 @@ def get_serie_info(serie_id: int) -> Serie:
         raise KeyError(f"Failed to get key {str(e)} from record {result}.")
 
 
-@backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3)
+@_retry_on_http_error
 def search_series(keywords: str) -> List[Serie]:
     """Perform a search to try to find a given serie"""
-    response = requests.post(
-        "https://api.mangaupdates.com/v1/series/search",
+    response = http_session.post(
+        f"{MANGAUPDATES_API_URL}/series/search",
         json=dict(
             search=keywords,
             perpage=20,
@@ -113,8 +246,8 @@ def search_series(keywords: str) -> List[Serie]:
     return matching_series
 
 
-@backoff.on_exception(backoff.expo, requests.HTTPError, max_tries=3)
+@_retry_on_http_error
 def get_image(url: str) -> bytes:
-    response = requests.get(url)
+    response = http_session.get(url, conditional=True)
     response.raise_for_status()
     return response.content
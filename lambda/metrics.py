@@ -0,0 +1,78 @@
+"""
+Timings and counters of a run, emitted as a CloudWatch Embedded Metric Format log line:
+cloudwatch extracts the metrics from the logs without any call to its api.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Tuple
+
+from config import METRICS_NAMESPACE
+
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'manga_scrapping')
+MAX_METRICS_PER_LINE = 100  # embedded metric format limit
+
+
+class MetricsRecorder:
+    """ sums the durations of spans and the counters, from any thread """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, float] = defaultdict(float)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.durations.clear()
+            self.counters.clear()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """ adds the time spent in the block to the duration of name, in milliseconds """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.durations[name] += duration
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def _snapshot(self) -> Tuple[Dict[str, float], Dict[str, str]]:
+        """ values and units of the recorded metrics """
+        with self._lock:
+            values = {**{name: round(duration, 3) for name, duration in self.durations.items()}, **self.counters}
+            units = {**{name: 'Milliseconds' for name in self.durations}, **{name: 'Count' for name in self.counters}}
+        return values, units
+
+    @staticmethod
+    def _emf_line(values: Dict[str, float], units: Dict[str, str]) -> Dict:
+        """ embedded metric format document of the given metrics """
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [dict(Namespace=METRICS_NAMESPACE,
+                                           Dimensions=[['FunctionName']],
+                                           Metrics=[dict(Name=name, Unit=units[name]) for name in values])],
+            },
+            'FunctionName': FUNCTION_NAME,
+            **values,
+        }
+
+    def flush(self) -> None:
+        """ prints the metrics on stdout, where the lambda runtime does not prefix lines, then resets them """
+        values, units = self._snapshot()
+        names = list(values)
+        for start in range(0, len(names), MAX_METRICS_PER_LINE):
+            line_values = {name: values[name] for name in names[start:start + MAX_METRICS_PER_LINE]}
+            print(json.dumps(self._emf_line(line_values, units)), flush=True)
+        self.reset()
+
+
+metrics = MetricsRecorder()
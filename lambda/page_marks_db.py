@@ -1,28 +1,105 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 import inspect
+from itertools import repeat
+from math import ceil
+import os
+import pickle
+import time
 import pytz
-from typing import List, Dict, Union, Iterable, Tuple
+from typing import Any, List, Dict, Union, Iterable, Iterator, Tuple, Set, TYPE_CHECKING
 
-import dateutil.parser
-import boto3
-from botocore.exceptions import ClientError, ValidationError
-
-from config import AWS_REGION
-from global_types import Chapter, Serializable
+from config import AWS_REGION, PAGE_MARKS_SCAN_SEGMENTS, PAGE_MARKS_CACHE_FILE, CHAPTER_WORKING_SET_SIZE
+from global_types import Chapter, Serializable, pack_chapters, unpack_chapters
 from logs import logger
+from metrics import metrics
+from releases_types import ReleaseCursor
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.types import Binary
+
+TABLE_NAME = 'manga_page_marks'
+# chapters of a serie beyond the CHAPTER_WORKING_SET_SIZE most recent ones
+ARCHIVE_TABLE_NAME = 'manga_page_marks_archive'
+
+# items that are not page marks are stored in the same table under keys that cannot be a bakaupdate serie id
+META_KEY_PREFIX = '#'
+RELEASE_CURSOR_KEY = f'{META_KEY_PREFIX}release_cursor'
+# incremented on every write of page marks, to know whether page marks cached by a warm container are up to date
+TABLE_VERSION_KEY = f'{META_KEY_PREFIX}table_version'
+# number of page marks, kept on the version item as the table item count also counts the meta items
+PAGE_MARK_COUNT_ATTRIBUTE = 'page_mark_count'
+# a subscriber item per email and the set of all their emails, to read them by key without a scan
+SUBSCRIBER_KEY_PREFIX = f'{META_KEY_PREFIX}subscriber:'
+SUBSCRIBERS_INDEX_KEY = f'{META_KEY_PREFIX}subscribers'
+
+BATCH_GET_MAX_KEYS = 100  # dynamodb limit
+BATCH_GET_BASE_DELAY = .05
+BATCH_GET_MAX_DELAY = 2.
+BATCH_GET_MAX_ATTEMPTS = 8  # batched reads of the same keys before giving up on a throttled table
+READ_UNIT_SIZE = 4096
+
+_cached_page_marks: Union[None, Tuple[int, List['PageMark']]] = None
+
+
+@lru_cache(maxsize=None)
+def _get_resource():
+    """ boto3 is imported and the resource created on first use, then kept across warm invocations """
+    import boto3
+    return boto3.resource('dynamodb', region_name=AWS_REGION)
+
+
+@lru_cache(maxsize=None)
+def _get_table():
+    return _get_resource().Table(TABLE_NAME)
+
+
+@lru_cache(maxsize=None)
+def _get_archive_table():
+    return _get_resource().Table(ARCHIVE_TABLE_NAME)
 
 
-dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+def _count_read(response: Dict) -> Dict:
+    """ adds the read capacity returned by a request made with ReturnConsumedCapacity='TOTAL' to the metrics """
+    return _count_capacity(response, 'ReadCapacityUnits')
 
-DYNAMO_TABLE = dynamodb.Table('manga_page_marks')
+
+def _count_write(response: Dict) -> Dict:
+    """ adds the write capacity returned by a request made with ReturnConsumedCapacity='TOTAL' to the metrics """
+    return _count_capacity(response, 'WriteCapacityUnits')
+
+
+def _count_capacity(response: Dict, metric: str) -> Dict:
+    consumed_capacities = response.get('ConsumedCapacity') or []
+    # batch requests return the capacity consumed on each table
+    for consumed_capacity in consumed_capacities if isinstance(consumed_capacities, list) else [consumed_capacities]:
+        metrics.count(metric, consumed_capacity.get('CapacityUnits', 0))
+    return response
 
 
 class CorruptedDynamoDbBase(UserWarning):
     pass
 
 
+class UnprocessedKeysError(Exception):
+    """ keys still left unprocessed by dynamodb after BATCH_GET_MAX_ATTEMPTS batched reads """
+    pass
+
+
+def _descending_key(chapter: Chapter) -> Tuple[float, float]:
+    """ sort key of a chapter in a list sorted from the most recent chapter """
+    volume, value = chapter.sort_key()
+    return -volume, -value
+
+
 class PageMark(Serializable):
     """ ORM for table manga_page_marks on dynamodb"""
+    # stored attributes that are not constructor parameters
+    storage_attributes = ('chapter_pack', 'archived_chapter_count')
+    # stored attributes kept as read from db until first accessed
+    lazy_attributes = ('latest_update', 'chapter_pack', 'chapter_marks')
 
     def __init__(self,
                  serie_id: str,  # bakaupdate serie id
@@ -31,104 +108,580 @@ class PageMark(Serializable):
                  latest_update: Union[datetime, None]=None,
                  chapter_marks: Union[List[Chapter], Tuple[Chapter]]= tuple()):  # all chapters for the serie
         self._serie_id = serie_id
+        # changes since the page mark was last read from or written to db, a new page mark is written in full
+        self._is_new = True
+        self._modified_attributes: Set[str] = set()
+        # values read from db that are not decoded yet (see lazy_attributes)
+        self._raw_attributes: Dict[str, Any] = dict()
+        # the oldest chapters are stored in the archive table and only read when needed (see archive_old_chapters)
+        # archived chapters are None until read.
+        self._archived_chapter_count = 0
+        self._archived_chapters: Union[None, List[Chapter]] = []
+        self._archive_index: Set[Chapter] = set()
+        self._archive_modified = False
+        # chapters stored as a list of maps instead of chapter_pack, replaced on the next write of the chapters
+        self._legacy_format = False
         self.serie_name = serie_name
         self.latest_update = latest_update
-        self.chapter_marks: List[Chapter] = sorted(chapter_marks, reverse=True)
+        self.chapter_marks = chapter_marks
 
     @property
     def serie_id(self) -> str:
         """ serie id is immutable """
         return self._serie_id
 
+    @property
+    def serie_name(self) -> Union[str, None]:
+        return self._serie_name
+
+    @serie_name.setter
+    def serie_name(self, serie_name: Union[str, None]) -> None:
+        self._serie_name = serie_name
+        self._modified_attributes.add('serie_name')
+
+    @property
+    def latest_update(self) -> Union[datetime, None]:
+        if 'latest_update' in self._raw_attributes:
+            self._decode_latest_update()
+        return self._latest_update
+
+    @latest_update.setter
+    def latest_update(self, latest_update: Union[datetime, None]) -> None:
+        self._raw_attributes.pop('latest_update', None)
+        self._latest_update = latest_update
+        self._modified_attributes.add('latest_update')
+
+    @property
+    def is_modified(self) -> bool:
+        """ whether the page mark has changes that are not stored in db """
+        return self._is_new or bool(self._modified_attributes) or self._archive_modified
+
+    @property
+    def needs_full_write(self) -> bool:
+        """ whether the page mark is new and can not be written as a delta """
+        return self._is_new
+
+    @property
+    def archive_modified(self) -> bool:
+        """ whether archived chapters changed since the page mark was persisted """
+        return self._archive_modified
+
+    def mark_as_persisted(self) -> 'PageMark':
+        """ forgets the changes once they are stored in db """
+        if self._is_new or 'chapter_pack' in self._modified_attributes:
+            self._legacy_format = False
+        self._is_new = False
+        self._modified_attributes.clear()
+        self._archive_modified = False
+        return self
+
+    def _warn_corrupted(self, warning_message_elem: List[str]) -> None:
+        if warning_message_elem:
+            warning_message = f'Corrupted PageMark document for serie id {self.serie_id}, ' \
+                              f'and serie name {self.serie_name or ""} ' + '\n'.join(warning_message_elem)
+            logger.warning(warning_message)
+
+    def _decode_latest_update(self) -> None:
+        raw_latest_update = self._raw_attributes.pop('latest_update')
+        self._latest_update = None
+        try:
+            # written by serialize in iso format, other formats are left to dateutil
+            self._latest_update = datetime.fromisoformat(raw_latest_update)
+        except (ValueError, TypeError):
+            pass
+        else:
+            return
+        import dateutil.parser
+        try:
+            self._latest_update = dateutil.parser.parse(raw_latest_update)
+        except (ValueError, TypeError) as e:
+            self._warn_corrupted([f'"latest_update" attribute has unrecognized format. Parsing error {e}. '
+                                  f'Value was : {raw_latest_update}'])
+
+    def _decode_chapters(self) -> None:
+        """ builds the chapters read from db on first access """
+        if 'chapter_pack' not in self._raw_attributes and 'chapter_marks' not in self._raw_attributes:
+            return
+        warning_message_elem = []
+        chapter_marks = list()
+        if 'chapter_pack' in self._raw_attributes:
+            try:
+                chapter_marks = unpack_chapters(_binary_value(self._raw_attributes.pop('chapter_pack')))
+            except (ValueError, TypeError) as e:
+                warning_message_elem.append(f'"chapter_pack" attribute is invalid: {e}')
+        for index_position, mark in enumerate(self._raw_attributes.pop('chapter_marks', [])):
+            try:
+                chapter_marks.append(Chapter.deserialize(mark))
+            except TypeError:
+                warning_message_elem.append(f' chapter_mark" attribute is invalid at position. {index_position},'
+                                            f' with key values "{str(mark)}"')
+        Chapter.prime_sort_keys(chapter_marks)
+        for index_position, chapter in enumerate(chapter_marks):
+            if not chapter.is_valid():
+                warning_message_elem.append(f'chapter_mark" attribute is invalid at position. {index_position},'
+                                            f' with key values "{str(chapter.serialize())}"')
+        self._warn_corrupted(warning_message_elem)
+        self._set_working_chapters(chapter_marks)
+        # decoding is not a change
+        self._modified_attributes.discard('chapter_pack')
+
+    def _set_working_chapters(self, chapter_marks: Iterable[Chapter]) -> None:
+        self._chapter_marks: List[Chapter] = sorted(chapter_marks, key=Chapter.sort_key, reverse=True)
+        # hash index for membership and ascending keys of chapter_marks to insert new chapters with bisect
+        self._chapter_index: Set[Chapter] = set(self._chapter_marks)
+        self._descending_keys: List[Tuple[float, float]] = [_descending_key(chapter) for chapter in self._chapter_marks]
+        self._modified_attributes.add('chapter_pack')
+
+    def _set_archived_chapters(self, archived_chapters: Iterable[Chapter]) -> None:
+        self._archived_chapters = sorted(archived_chapters, key=Chapter.sort_key, reverse=True)
+        self._archive_index = set(self._archived_chapters)
+        self._archived_chapter_count = len(self._archived_chapters)
+
+    def _get_archived_chapters(self) -> List[Chapter]:
+        if self._archived_chapters is None:
+            self._set_archived_chapters(_get_archived_chapters(self.serie_id))
+        return self._archived_chapters
+
+    @property
+    def chapter_marks(self) -> List[Chapter]:
+        """
+        all chapters sorted from the most recent, reading archived chapters if needed.
+        use extend to add chapters so that they stay indexed.
+        """
+        self._decode_chapters()
+        if not self._archived_chapter_count:
+            return self._chapter_marks
+        return self._chapter_marks + self._get_archived_chapters()
+
+    @chapter_marks.setter
+    def chapter_marks(self, chapter_marks: Iterable[Chapter]) -> None:
+        self._raw_attributes.pop('chapter_pack', None)
+        self._raw_attributes.pop('chapter_marks', None)
+        self._set_working_chapters(chapter_marks)
+        if self._archived_chapter_count:
+            self._archive_modified = True
+        self._set_archived_chapters([])
+
+    def oldest_chapters(self, count: int) -> List[Chapter]:
+        """ the count oldest chapters from the most recent one, the archived chapters being read if there are any """
+        return self.chapter_marks[-count:] if count > 0 else []
+
+    def archive_old_chapters(self, working_set_size: int) -> None:
+        """ moves the oldest chapters to the archive once there are more than twice working_set_size others """
+        self._decode_chapters()
+        if len(self._chapter_marks) <= 2 * working_set_size:
+            return
+        archived_chapters = self._chapter_marks[working_set_size:] + self._get_archived_chapters()
+        self._set_working_chapters(self._chapter_marks[:working_set_size])
+        self._set_archived_chapters(archived_chapters)
+        self._archive_modified = True
+
     def __hash__(self) -> int:
         return hash(self._serie_id)
 
     def __contains__(self, item: Chapter) -> bool:
-        return item in self.chapter_marks
+        self._decode_chapters()
+        if item in self._chapter_index:
+            return True
+        if not self._archived_chapter_count:
+            return False
+        # archived chapters are never more recent than the oldest chapter that is not archived
+        if self._descending_keys and _descending_key(item) < self._descending_keys[-1]:
+            return False
+        self._get_archived_chapters()
+        return item in self._archive_index
 
     def __iter__(self):
         for chapter in self.chapter_marks:
             yield chapter
 
     def __repr__(self) -> str:
+        self._decode_chapters()
         header_sep = '\n\t'
         return (f'{str(type(self))}<'
                 + header_sep.join([f'serie: {self.serie_id}',
                                    f'name: {self.serie_name}',]
-                                  + [f'\tchapter {chapter}' for chapter in self.chapter_marks]) +
+                                  + [f'\tchapter {chapter}' for chapter in self._chapter_marks]
+                                  + ([f'\t{self._archived_chapter_count} archived chapters']
+                                     if self._archived_chapter_count else [])) +
                 '>')
 
     def extend(self, chapters: Iterable[Chapter]) -> 'PageMark':
         """ offers easy implementation to add chapters to chapter marks """
-        new_chapter_marks = [chapter for chapter in chapters if chapter not in self]
-        self.chapter_marks = sorted(new_chapter_marks + self.chapter_marks,  reverse=True)
+        self._decode_chapters()
+        for chapter in chapters:
+            if chapter in self:
+                continue
+            key = _descending_key(chapter)
+            if self._archived_chapter_count and (not self._descending_keys or key >= self._descending_keys[-1]):
+                # keeps archived chapters older than the others
+                self._set_archived_chapters(self._get_archived_chapters() + [chapter])
+                self._archive_modified = True
+                continue
+            position = bisect_right(self._descending_keys, key)
+            self._descending_keys.insert(position, key)
+            self._chapter_marks.insert(position, chapter)
+            self._chapter_index.add(chapter)
+            self._modified_attributes.add('chapter_pack')
         return self
 
+    def _serialize_latest_update(self) -> Union[str, None]:
+        if 'latest_update' in self._raw_attributes:
+            return self._raw_attributes['latest_update']
+        return None if self._latest_update is None else self._latest_update.astimezone(pytz.utc).isoformat()
+
+    def _serialize_chapter_pack(self) -> Union[bytes, None]:
+        # chapters that were not accessed are written back as read, unless they are in the legacy format
+        if 'chapter_pack' in self._raw_attributes and 'chapter_marks' not in self._raw_attributes:
+            return _binary_value(self._raw_attributes['chapter_pack'])
+        self._decode_chapters()
+        return pack_chapters(self._chapter_marks) if self._chapter_marks else None
+
     def serialize(self) -> Dict:
+        """ item of the page mark, archived chapters are serialized apart with serialize_archive """
         serialized_mark = dict(serie_id=self.serie_id)
         if self.serie_name is not None:
             serialized_mark['serie_name'] = self.serie_name
-        if self.latest_update is not None:
-            serialized_mark['latest_update'] = self.latest_update.astimezone(pytz.utc).isoformat()
-        if self.chapter_marks:
-            serialized_mark['chapter_marks'] = [chapter.serialize() for chapter in self.chapter_marks]
+        latest_update = self._serialize_latest_update()
+        if latest_update is not None:
+            serialized_mark['latest_update'] = latest_update
+        chapter_pack = self._serialize_chapter_pack()
+        if chapter_pack is not None:
+            serialized_mark['chapter_pack'] = chapter_pack
+        if self._archived_chapter_count:
+            serialized_mark['archived_chapter_count'] = self._archived_chapter_count
         return serialized_mark
 
+    def serialize_archive(self) -> Union[None, Dict]:
+        """ item of the archived chapters or None if there are none """
+        if not self._archived_chapter_count:
+            return None
+        return dict(serie_id=self.serie_id, chapter_pack=pack_chapters(self._get_archived_chapters()))
+
+    def serialize_changes(self) -> Dict:
+        """ returns the attributes modified since the page mark was persisted (None when they were removed) """
+        if self.needs_full_write:
+            raise ValueError(f'Changes of page mark {self.serie_id} can only be persisted as a whole.')
+        changes = dict()
+        if 'serie_name' in self._modified_attributes:
+            changes['serie_name'] = self.serie_name
+        if 'latest_update' in self._modified_attributes:
+            changes['latest_update'] = self._serialize_latest_update()
+        if 'chapter_pack' in self._modified_attributes or self._archive_modified:
+            changes['chapter_pack'] = self._serialize_chapter_pack()
+            changes['archived_chapter_count'] = self._archived_chapter_count or None
+            if self._legacy_format:
+                changes['chapter_marks'] = None
+        return changes
+
     @classmethod
     def deserialize(cls, dict_data: Dict) -> 'PageMark':
         """
-        transforms a dict into an objet.
-        may trigger warnings if object does not have the correct format
+        transforms a dict into an objet. reads both chapter_pack and the former list of chapter_marks.
+        dates and chapters are only decoded on first access, then may trigger warnings if they do not have the
+        correct format
         """
-        deserialized_page_mark = cls(serie_id=dict_data['serie_id'])
-        warning_message_elem = []
-
+        deserialized_page_mark = cls(serie_id=dict_data['serie_id'], serie_name=dict_data.get('serie_name'))
         if 'serie_name' not in dict_data:
-            warning_message_elem.append('"serie_name" attribute is missing.')
-        else:
-            deserialized_page_mark.serie_name = dict_data['serie_name']
+            deserialized_page_mark._warn_corrupted(['"serie_name" attribute is missing.'])
+        deserialized_page_mark._raw_attributes = {attribute: dict_data[attribute]
+                                                  for attribute in cls.lazy_attributes if attribute in dict_data}
+        deserialized_page_mark._legacy_format = 'chapter_marks' in dict_data
+        deserialized_page_mark._archived_chapter_count = int(dict_data.get('archived_chapter_count', 0))
+        if deserialized_page_mark._archived_chapter_count:
+            deserialized_page_mark._archived_chapters = None
+        deserialized_page_mark._is_new = False
+        deserialized_page_mark._modified_attributes.clear()
+        return deserialized_page_mark
 
-        if 'latest_update' in dict_data:
-            try:
-                deserialized_page_mark.latest_update = dateutil.parser.parse(dict_data['latest_update'])
-            except KeyError:
-                pass
-            except ValueError as e:
-                warning_message_elem.append(f'"latest_update" attribute has unrecognized format. Parsing error {e}. '
-                                            f'Value was : {dict_data.get("latest_update")}')
 
-        chapter_marks = list()
-        for index_position, mark in enumerate(dict_data.get('chapter_marks', [])):
-            try:
-                chapter = Chapter.deserialize(mark)
-                if not chapter.is_valid():
-                    warning_message_elem.append(f'chapter_mark" attribute is invalid at position. {index_position},'
-                                                f' with key values "{str(mark)}"')
-                chapter_marks.append(chapter)
-            except TypeError:
-                warning_message_elem.append(f' chapter_mark" attribute is invalid at position. {index_position},'
-                                            f' with key values "{str(mark)}"')
-        deserialized_page_mark.chapter_marks = sorted(chapter_marks, reverse=True)
+class Subscriber(Serializable):
+    """ recipient of the newsletter with the series it watches, stored next to the page marks """
 
-        if warning_message_elem:
-            warning_message = f'Corrupted PageMark document for serie id {deserialized_page_mark.serie_id}, ' \
-                              f'and serie name {dict_data.get("serie_name", "")} ' + '\n'.join(warning_message_elem)
-            logger.warning(warning_message)
-        return deserialized_page_mark
+    def __init__(self, email: str, serie_ids: Iterable[str] = tuple()):
+        self.email = email
+        self.serie_ids: Set[str] = set(serie_ids)
+
+    def serialize(self) -> Dict:
+        serialized_subscriber = dict(serie_id=f'{SUBSCRIBER_KEY_PREFIX}{self.email}', email=self.email)
+        # dynamodb sets can not be empty
+        if self.serie_ids:
+            serialized_subscriber['serie_ids'] = set(self.serie_ids)
+        return serialized_subscriber
+
+    @classmethod
+    def deserialize(cls, dict_data: Dict) -> 'Subscriber':
+        return cls(email=dict_data['email'], serie_ids=dict_data.get('serie_ids', set()))
+
+    def __repr__(self) -> str:
+        return f'Subscriber {self.email} watching {len(self.serie_ids)} series'
 
 
-def get_all() -> List[PageMark]:
-    """ Get all page coming from db. """
+def _page_mark_attributes() -> List[str]:
+    """ attributes stored for a page mark, as defined by PageMark constructor """
     attributes = list(inspect.signature(PageMark.__init__).parameters.keys())
     attributes.remove('self')
-    response = DYNAMO_TABLE.scan(ProjectionExpression=', '.join(attributes))
-    return [PageMark.deserialize(page_mark_elem) for page_mark_elem in response['Items']]
+    return attributes + list(PageMark.storage_attributes)
+
+
+def _binary_value(value: Union[bytes, 'Binary']) -> bytes:
+    """ boto3 wraps binary attributes read from dynamodb """
+    from boto3.dynamodb.types import Binary
+    return value.value if isinstance(value, Binary) else bytes(value)
+
+
+def _get_archived_chapters(serie_id: str) -> List[Chapter]:
+    """ reads the archived chapters of a serie """
+    item = _count_read(_get_archive_table().get_item(Key=dict(serie_id=serie_id),
+                                                      ReturnConsumedCapacity='TOTAL')).get('Item')
+    if item is None:
+        logger.warning(f'Archived chapters of serie {serie_id} are missing.')
+        return []
+    return unpack_chapters(_binary_value(item['chapter_pack']))
+
+
+def _delete_archive(serie_id: str) -> None:
+    _count_write(_get_archive_table().delete_item(Key=dict(serie_id=serie_id), ReturnConsumedCapacity='TOTAL'))
+
+
+def _write_archive(page_mark: PageMark) -> bool:
+    """
+    moves old chapters to the archive if needed and writes the archive when it changed.
+    returns whether the archive item was written or deleted
+    """
+    page_mark.archive_old_chapters(CHAPTER_WORKING_SET_SIZE)
+    if not page_mark.archive_modified:
+        return False
+    archive = page_mark.serialize_archive()
+    if archive is None:
+        _delete_archive(page_mark.serie_id)
+    else:
+        _count_write(_get_archive_table().put_item(Item=archive, ReturnConsumedCapacity='TOTAL'))
+    return True
+
+
+def _scan_segment(segment: int = 0, total_segments: int = 1) -> List[PageMark]:
+    """ scans one segment of the table following pagination. a page is deserialized while the next one is read """
+    import boto3
+    from boto3.dynamodb.conditions import Attr
+    # boto3 resources are not thread safe: each segment uses its own
+    table = _get_table() if total_segments == 1 \
+        else boto3.session.Session().resource('dynamodb', region_name=AWS_REGION).Table(TABLE_NAME)
+    scan_parameters = dict(ProjectionExpression=', '.join(_page_mark_attributes()),
+                           FilterExpression=~Attr('serie_id').begins_with(META_KEY_PREFIX),
+                           ReturnConsumedCapacity='TOTAL')
+    if total_segments > 1:
+        scan_parameters.update(Segment=segment, TotalSegments=total_segments)
+    page_marks = []
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        response = table.scan(**scan_parameters)
+        while True:
+            next_response = None
+            if 'LastEvaluatedKey' in response:
+                scan_parameters['ExclusiveStartKey'] = response['LastEvaluatedKey']
+                next_response = prefetcher.submit(table.scan, **scan_parameters)
+            _count_read(response)
+            page_marks.extend(PageMark.deserialize(page_mark_elem) for page_mark_elem in response['Items'])
+            if next_response is None:
+                return page_marks
+            response = next_response.result()
+
+
+def _get_version_item() -> Dict[str, Any]:
+    """ version and page mark count item, empty if the table was never written since it exists """
+    return _count_read(_get_table().get_item(Key=dict(serie_id=TABLE_VERSION_KEY), ConsistentRead=True,
+                                             ReturnConsumedCapacity='TOTAL')).get('Item', {})
+
+
+def _get_version() -> int:
+    """ current version of the page marks in the table """
+    return int(_get_version_item().get('version', 0))
+
+
+def get_page_mark_count() -> Union[None, int]:
+    """ number of page marks in the table, None until a full scan of the table counted them """
+    count = _get_version_item().get(PAGE_MARK_COUNT_ATTRIBUTE)
+    return None if count is None else int(count)
+
+
+def _is_conditional_check_failure(error: Exception) -> bool:
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+
+def _set_page_mark_count(version: int, page_mark_count: int) -> None:
+    """ stores the count of a full scan, unless the table was written since the scan started """
+    from botocore.exceptions import ClientError
+    condition = dict(ConditionExpression='attribute_not_exists(version)') if version == 0 else \
+        dict(ConditionExpression='version = :version', ExpressionAttributeValues={':version': version})
+    condition.setdefault('ExpressionAttributeValues', {})[':count'] = page_mark_count
+    try:
+        _count_write(_get_table().update_item(Key=dict(serie_id=TABLE_VERSION_KEY),
+                                              UpdateExpression=f'SET {PAGE_MARK_COUNT_ATTRIBUTE} = :count',
+                                              ReturnConsumedCapacity='TOTAL',
+                                              **condition))
+    except ClientError as e:
+        if not _is_conditional_check_failure(e):
+            raise
+
+
+def _get_cache(version: int) -> Union[None, List[PageMark]]:
+    """ page marks cached in memory or in the /tmp snapshot if they are still at the given version """
+    global _cached_page_marks
+    if _cached_page_marks is None:
+        try:
+            with open(PAGE_MARKS_CACHE_FILE, 'rb') as f:
+                _cached_page_marks = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning(f'Failed to load page marks snapshot {PAGE_MARKS_CACHE_FILE}', exc_info=True)
+            return None
+    cached_version, page_marks = _cached_page_marks
+    # page marks modified but not written by a failed run can not be used
+    if cached_version != version or any(page_mark.is_modified for page_mark in page_marks):
+        return None
+    return page_marks
+
+
+def _set_cache(version: int, page_marks: List[PageMark]) -> None:
+    global _cached_page_marks
+    _cached_page_marks = (version, page_marks)
+    tmp_file = f'{PAGE_MARKS_CACHE_FILE}.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(_cached_page_marks, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, PAGE_MARKS_CACHE_FILE)
+    except OSError:
+        logger.warning(f'Failed to write page marks snapshot {PAGE_MARKS_CACHE_FILE}', exc_info=True)
+
+
+def _clear_cache() -> None:
+    global _cached_page_marks
+    _cached_page_marks = None
+    try:
+        os.remove(PAGE_MARKS_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _change_page_mark_count(change: int) -> None:
+    """ adds change to the page mark count, once counted by a full scan: before that it can not be kept up to date """
+    from botocore.exceptions import ClientError
+    try:
+        _count_write(_get_table().update_item(Key=dict(serie_id=TABLE_VERSION_KEY),
+                                              UpdateExpression=f'ADD {PAGE_MARK_COUNT_ATTRIBUTE} :change',
+                                              ConditionExpression=f'attribute_exists({PAGE_MARK_COUNT_ATTRIBUTE})',
+                                              ExpressionAttributeValues={':change': change},
+                                              ReturnConsumedCapacity='TOTAL'))
+    except ClientError as e:
+        if not _is_conditional_check_failure(e):
+            raise
+
+
+def _bump_version(written_page_marks: Union[None, List[PageMark]] = None, count_change: int = 0) -> None:
+    """
+    increments the table version after a write, and the page mark count by count_change.
+    cached page marks stay valid if they were at the previous version and contain all the written page marks.
+    """
+    if count_change:
+        _change_page_mark_count(count_change)
+    response = _count_write(_get_table().update_item(Key=dict(serie_id=TABLE_VERSION_KEY),
+                                                     UpdateExpression='ADD version :increment',
+                                                     ExpressionAttributeValues={':increment': 1},
+                                                     ReturnValues='UPDATED_NEW',
+                                                     ReturnConsumedCapacity='TOTAL'))
+    version = int(response['Attributes']['version'])
+    if _cached_page_marks is None:
+        return
+    cached_version, page_marks = _cached_page_marks
+    cached_ids = {id(page_mark) for page_mark in page_marks}
+    if written_page_marks is not None and cached_version == version - 1 \
+            and all(id(page_mark) in cached_ids for page_mark in written_page_marks):
+        _set_cache(version, page_marks)
+    else:
+        _clear_cache()
+
+
+def get_cached() -> Union[None, List[PageMark]]:
+    """ Get all page marks from a previous call to get_all if the table was not written since, None otherwise. """
+    page_marks = _get_cache(_get_version())
+    if page_marks is not None:
+        logger.info(f'Using {len(page_marks)} cached page marks.')
+    return page_marks
+
+
+def get_all(total_segments: int = PAGE_MARKS_SCAN_SEGMENTS, use_cache: bool = True) -> List[PageMark]:
+    """
+    Get all page coming from db, scanning total_segments segments of the table in parallel.
+    Page marks from a previous call are returned without scanning if the table was not written since.
+    """
+    version_item = _get_version_item()
+    version = int(version_item.get('version', 0))
+    if use_cache:
+        page_marks = _get_cache(version)
+        if page_marks is not None:
+            logger.info(f'Using {len(page_marks)} cached page marks at version {version}.')
+            return page_marks
+    if total_segments <= 1:
+        page_marks = _scan_segment()
+    else:
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            segments_page_marks = executor.map(_scan_segment, range(total_segments), repeat(total_segments))
+            page_marks = [page_mark for page_marks in segments_page_marks for page_mark in page_marks]
+    if version_item.get(PAGE_MARK_COUNT_ATTRIBUTE) != len(page_marks):
+        _set_page_mark_count(version, len(page_marks))
+    _set_cache(version, page_marks)
+    return page_marks
+
+
+def _batch_get_items(keys: List[Dict[str, str]], projection: Union[None, str] = None) -> Iterator[Dict]:
+    """ reads items by key with batched reads, keys absent from db are ignored """
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request_items = {TABLE_NAME: dict(Keys=keys[start:start + BATCH_GET_MAX_KEYS])}
+        if projection is not None:
+            request_items[TABLE_NAME]['ProjectionExpression'] = projection
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                # keys are left unprocessed when the table is throttled
+                time.sleep(min(BATCH_GET_BASE_DELAY * 2 ** (attempt - 1), BATCH_GET_MAX_DELAY))
+            response = _count_read(_get_resource().batch_get_item(RequestItems=request_items,
+                                                                  ReturnConsumedCapacity='TOTAL'))
+            yield from response['Responses'].get(TABLE_NAME, [])
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+        else:
+            raise UnprocessedKeysError(f'{len(request_items[TABLE_NAME]["Keys"])} keys still unprocessed '
+                                       f'after {BATCH_GET_MAX_ATTEMPTS} batched reads.')
+
+
+def get_many(serie_ids: Iterable[str]) -> List[PageMark]:
+    """ Get the page marks of the given series with batched reads, series absent from db are ignored. """
+    keys = [dict(serie_id=serie_id) for serie_id in dict.fromkeys(serie_ids)]
+    return [PageMark.deserialize(item) for item in _batch_get_items(keys, ', '.join(_page_mark_attributes()))]
+
+
+def estimate_table() -> Tuple[int, int]:
+    """ item count and size in bytes of the table, as refreshed by dynamodb every 6 hours or so """
+    description = _get_table().meta.client.describe_table(TableName=TABLE_NAME)['Table']
+    return int(description['ItemCount']), int(description['TableSizeBytes'])
+
+
+def keyed_fetch_is_cheaper(serie_count: int, item_count: int, table_size: int) -> bool:
+    """ whether reading serie_count page marks by key consumes less read capacity than scanning the table """
+    if item_count == 0:
+        return False
+    # eventually consistent reads cost half a unit per 4KB, for each item with a get and for the whole table with a scan
+    scan_units = ceil(table_size / READ_UNIT_SIZE) / 2
+    keyed_units = serie_count * max(1, ceil(table_size / item_count / READ_UNIT_SIZE)) / 2
+    return keyed_units < scan_units
 
 
 def get(serie_id: str) -> Union[None, PageMark]:
     """ Retrieves a page mark object from db or returns None if no matching key is found. """
+    from botocore.exceptions import ClientError
     try:
-        item = DYNAMO_TABLE.get_item(Key=dict(serie_id=serie_id))['Item']
+        item = _count_read(_get_table().get_item(Key=dict(serie_id=serie_id), ReturnConsumedCapacity='TOTAL'))['Item']
     except ClientError:
         logger.error('failed to get ', exc_info=True)
         return None
@@ -137,24 +690,161 @@ def get(serie_id: str) -> Union[None, PageMark]:
     return PageMark.deserialize(item)
 
 
-def batch_put(page_marks: Iterable[PageMark]) -> None:
-    """ writes all page marks on dynamodb table"""
-    with DYNAMO_TABLE.batch_writer() as batch:
+def _batch_put(page_marks: Iterable[PageMark]) -> Tuple[List[PageMark], int]:
+    """ returns the written page marks and the number of them that were not in db yet """
+    page_marks = list(page_marks)
+    serie_ids = set(page_mark.serie_id for page_mark in page_marks)
+    # batched writes do not tell whether they replaced an item
+    stored_serie_ids = {item['serie_id']
+                        for item in _batch_get_items([dict(serie_id=serie_id) for serie_id in serie_ids], 'serie_id')}
+    written_page_marks = []
+    with _get_table().batch_writer() as batch, _get_archive_table().batch_writer() as archive_batch:
         for page_mark in page_marks:
+            if not _write_archive(page_mark) and page_mark.serialize_archive() is None:
+                # the archive of a former version of the page mark is not known without reading it
+                archive_batch.delete_item(Key=dict(serie_id=page_mark.serie_id))
             batch.put_item(Item=page_mark.serialize())
+            page_mark.mark_as_persisted()
+            written_page_marks.append(page_mark)
+    return written_page_marks, len(serie_ids - stored_serie_ids)
+
+
+def batch_put(page_marks: Iterable[PageMark]) -> None:
+    """ writes all page marks on dynamodb table"""
+    written_page_marks, added_count = _batch_put(page_marks)
+    _bump_version(written_page_marks, count_change=added_count)
 
 
 def put(page_mark: PageMark) -> None:
     """ writes on dynamodb table"""
-    DYNAMO_TABLE.put_item(Item=page_mark.serialize())
+    archive_written = _write_archive(page_mark)
+    response = _count_write(_get_table().put_item(Item=page_mark.serialize(), ReturnValues='ALL_OLD',
+                                                  ReturnConsumedCapacity='TOTAL'))
+    if not archive_written and page_mark.serialize_archive() is None \
+            and response.get('Attributes', {}).get('archived_chapter_count'):
+        # the replaced page mark had archived chapters
+        _delete_archive(page_mark.serie_id)
+    page_mark.mark_as_persisted()
+    _bump_version([page_mark], count_change=0 if 'Attributes' in response else 1)
+
+
+def _update(page_mark: PageMark) -> None:
+    """ writes the changes of a page mark, the archived chapters are only written if they changed """
+    _write_archive(page_mark)
+    changes = page_mark.serialize_changes()
+    set_expressions, remove_expressions = [], []
+    attribute_names, attribute_values = dict(), dict()
+    for index, (attribute, value) in enumerate(changes.items()):
+        attribute_names[f'#attribute{index}'] = attribute
+        if value is None:
+            remove_expressions.append(f'#attribute{index}')
+        else:
+            set_expressions.append(f'#attribute{index} = :value{index}')
+            attribute_values[f':value{index}'] = value
+    update_expression = ''
+    if set_expressions:
+        update_expression += 'SET ' + ', '.join(set_expressions)
+    if remove_expressions:
+        update_expression += ' REMOVE ' + ', '.join(remove_expressions)
+    optional_parameters = dict()
+    if attribute_names:
+        optional_parameters['ExpressionAttributeNames'] = attribute_names
+    if attribute_values:
+        optional_parameters['ExpressionAttributeValues'] = attribute_values
+    _count_write(_get_table().update_item(Key=dict(serie_id=page_mark.serie_id),
+                                          UpdateExpression=update_expression.strip(),
+                                          ReturnConsumedCapacity='TOTAL',
+                                          **optional_parameters))
+    page_mark.mark_as_persisted()
+
+
+def save_modified(page_marks: Iterable[PageMark]) -> int:
+    """
+    writes only the page marks that were modified, with only their modified attributes.
+    archived chapters are not sent again unless they changed.
+    returns the number of page marks written.
+    """
+    new_page_marks = []
+    written_page_marks = []
+    for page_mark in page_marks:
+        if not page_mark.is_modified:
+            continue
+        if page_mark.needs_full_write:
+            new_page_marks.append(page_mark)
+            continue
+        _update(page_mark)
+        written_page_marks.append(page_mark)
+    added_count = 0
+    if new_page_marks:
+        written_new_page_marks, added_count = _batch_put(new_page_marks)
+        written_page_marks.extend(written_new_page_marks)
+    if written_page_marks:
+        _bump_version(written_page_marks, count_change=added_count)
+    return len(written_page_marks)
 
 
 def delete(page_mark_serie_id: str) -> None:
     """ delete the record in dynamodb """
+    from botocore.exceptions import ValidationError
     try:
-        DYNAMO_TABLE.delete_item(
+        response = _count_write(_get_table().delete_item(
             Key=dict(serie_id=page_mark_serie_id),
-        )
+            ReturnValues='ALL_OLD',
+            ReturnConsumedCapacity='TOTAL',
+        ))
+        _get_archive_table().delete_item(Key=dict(serie_id=page_mark_serie_id))
     except ValidationError as e:
         logger.error(f"serie {page_mark_serie_id} does not exists in db.")
         raise e
+    _bump_version(count_change=-1 if 'Attributes' in response else 0)
+
+
+def get_release_cursor() -> ReleaseCursor:
+    """ Retrieves the release feed cursor or an empty one if it was never stored. """
+    item = _count_read(_get_table().get_item(Key=dict(serie_id=RELEASE_CURSOR_KEY),
+                                             ReturnConsumedCapacity='TOTAL')).get('Item')
+    if item is None:
+        return ReleaseCursor()
+    return ReleaseCursor.deserialize(item)
+
+
+def put_release_cursor(cursor: ReleaseCursor) -> None:
+    """ writes the release feed cursor next to the page marks """
+    _count_write(_get_table().put_item(Item=dict(serie_id=RELEASE_CURSOR_KEY, **cursor.serialize()),
+                                       ReturnConsumedCapacity='TOTAL'))
+
+
+def get_subscribers() -> List[Subscriber]:
+    """ Retrieves all subscribers, through the set of their emails. """
+    index = _count_read(_get_table().get_item(Key=dict(serie_id=SUBSCRIBERS_INDEX_KEY),
+                                              ReturnConsumedCapacity='TOTAL')).get('Item')
+    if index is None:
+        return []
+    keys = [dict(serie_id=f'{SUBSCRIBER_KEY_PREFIX}{email}') for email in sorted(index.get('emails', []))]
+    return [Subscriber.deserialize(item) for item in _batch_get_items(keys)]
+
+
+def get_subscriber(email: str) -> Union[None, Subscriber]:
+    """ Retrieves a subscriber or None if the email is not subscribed. """
+    item = _count_read(_get_table().get_item(Key=dict(serie_id=f'{SUBSCRIBER_KEY_PREFIX}{email}'),
+                                             ReturnConsumedCapacity='TOTAL')).get('Item')
+    return None if item is None else Subscriber.deserialize(item)
+
+
+def put_subscriber(subscriber: Subscriber) -> None:
+    """ writes a subscriber and adds its email to the subscribers index """
+    _count_write(_get_table().put_item(Item=subscriber.serialize(), ReturnConsumedCapacity='TOTAL'))
+    _count_write(_get_table().update_item(Key=dict(serie_id=SUBSCRIBERS_INDEX_KEY),
+                                          UpdateExpression='ADD emails :emails',
+                                          ExpressionAttributeValues={':emails': {subscriber.email}},
+                                          ReturnConsumedCapacity='TOTAL'))
+
+
+def delete_subscriber(email: str) -> None:
+    """ deletes a subscriber and removes its email from the subscribers index """
+    _count_write(_get_table().delete_item(Key=dict(serie_id=f'{SUBSCRIBER_KEY_PREFIX}{email}'),
+                                          ReturnConsumedCapacity='TOTAL'))
+    _count_write(_get_table().update_item(Key=dict(serie_id=SUBSCRIBERS_INDEX_KEY),
+                                          UpdateExpression='DELETE emails :emails',
+                                          ExpressionAttributeValues={':emails': {email}},
+                                          ReturnConsumedCapacity='TOTAL'))
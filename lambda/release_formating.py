@@ -1,9 +1,13 @@
 from typing import Union, Iterable
 from urllib.parse import urlunparse, urlencode
 
+from global_types import Chapter
 from page_marks_db import PageMark
 from releases_types import ChapterRelease, SerieReleases
+from config import MAIL_IMAGE_VARIANTS
 from img_hosting import build_serie_img_viewer_url
+from logs import logger
+from metrics import metrics
 
 
 class FormattingWarning(Warning):
@@ -13,12 +17,16 @@ class FormattingWarning(Warning):
 
 class FormattedChapterRelease(ChapterRelease):
     """ data to be displayed for a single release """
+    __slots__ = ('link', 'top')
+
     def __init__(self,
                  scraped_chapter_release: ChapterRelease,
                  top: bool = False,
                  url_release_link: Union[None, str] = None):
-        super(FormattedChapterRelease, self).__init__(**{var: getattr(scraped_chapter_release, var)
-                                                         for var in vars(scraped_chapter_release)})
+        super(FormattedChapterRelease, self).__init__(group=scraped_chapter_release.group,
+                                                      chapter=scraped_chapter_release.chapter,
+                                                      volume=scraped_chapter_release.volume)
+        self._sort_key = scraped_chapter_release._sort_key  # already computed when the releases were sorted
         self.link = url_release_link
         self.top = top
 
@@ -29,10 +37,12 @@ class FormattedSerieReleases(SerieReleases):
                  serie_id: str,
                  serie_title: str,
                  serie_img_link: str,
-                 chapters_releases: Iterable[FormattedChapterRelease]):
+                 chapters_releases: Iterable[FormattedChapterRelease],
+                 serie_img_2x_link: Union[None, str] = None):
         super(FormattedSerieReleases, self).__init__(serie_id, chapters_releases)
         self.serie_title = serie_title
         self.serie_img_link = serie_img_link
+        self.serie_img_2x_link = serie_img_2x_link
 
 
 def add_likely_link(
@@ -64,12 +74,13 @@ def format_new_releases(serie_releases: SerieReleases,
                         top_chapter_lim: int= 5) -> FormattedSerieReleases:
     """ returns new releases with links and information of whether they are top chapters as defined by
      top_chapter_limit"""
-    print(serie_page_mark)
-    new_releases = sorted([release for release in serie_releases if release not in serie_page_mark.chapter_marks],
-                          reverse=True)
-    chapters_page_mark = sorted(serie_page_mark.chapter_marks, reverse=True)
-    if chapters_page_mark:
-        limiting_chapter = chapters_page_mark[-min(len(chapters_page_mark), top_chapter_lim)]
+    # the page mark itself is not logged as its repr decodes and lists all its chapters
+    logger.debug('Formatting releases of serie %s, %s', serie_page_mark.serie_id, serie_page_mark.serie_name)
+    new_releases = sorted([release for release in serie_releases if release not in serie_page_mark],
+                          key=Chapter.sort_key, reverse=True)
+    oldest_chapters = serie_page_mark.oldest_chapters(top_chapter_lim)
+    if oldest_chapters:
+        limiting_chapter = oldest_chapters[0]
 
         def is_top(release):
             return release > limiting_chapter
@@ -79,11 +90,19 @@ def format_new_releases(serie_releases: SerieReleases,
             return True
     formatted_scrapped_new_chapter_release = []
     for release in new_releases:
-        formatted_release = add_likely_link(serie_page_mark.serie_name, release)
-        formatted_release.top = is_top(release)
+        formatted_release = add_likely_link(serie_page_mark.serie_name,
+                                            FormattedChapterRelease(release, top=is_top(release)))
         formatted_scrapped_new_chapter_release.append(formatted_release)
+    with metrics.span('SignImageUrls'):
+        if MAIL_IMAGE_VARIANTS:
+            serie_img_link = build_serie_img_viewer_url(serie_page_mark.serie_id, 'thumb')
+            serie_img_2x_link = build_serie_img_viewer_url(serie_page_mark.serie_id, '2x')
+        else:
+            serie_img_link = build_serie_img_viewer_url(serie_page_mark.serie_id)
+            serie_img_2x_link = None
     return FormattedSerieReleases(
         serie_id=serie_page_mark.serie_id,
         serie_title=serie_page_mark.serie_name,
-        serie_img_link=build_serie_img_viewer_url(serie_page_mark.serie_id),
-        chapters_releases=formatted_scrapped_new_chapter_release)
+        serie_img_link=serie_img_link,
+        chapters_releases=formatted_scrapped_new_chapter_release,
+        serie_img_2x_link=serie_img_2x_link)
@@ -1,6 +1,7 @@
-from typing import Union, Iterable, NamedTuple
+from datetime import date, timedelta
+from typing import Union, Iterable, NamedTuple, Dict, Set, Any
 
-from global_types import Chapter
+from global_types import Chapter, Serializable
 
 
 class Serie(NamedTuple):
@@ -15,6 +16,8 @@ class Serie(NamedTuple):
 
 class ChapterRelease(Chapter):
     """ data on a given chapter """
+    __slots__ = ('group',)
+
     def __init__(self, group: str, chapter: str, volume: Union[int, None]= None):
         super(ChapterRelease, self).__init__(chapter, volume)
         self.group = group
@@ -26,15 +29,71 @@ class SerieReleases:
                  serie_id: str,
                  chapters_releases: Iterable[ChapterRelease]):
         self.serie_id = serie_id
-        self.releases = sorted(chapters_releases, reverse=True)
+        self.releases = sorted(chapters_releases, key=Chapter.sort_key, reverse=True)
 
     def __iter__(self):
         for chapter_release in self.releases:
             yield chapter_release
 
+    def extend(self, chapters_releases: Iterable[ChapterRelease]) -> 'SerieReleases':
+        """ adds the releases that are not already present """
+        new_releases = [release for release in chapters_releases if release not in self.releases]
+        self.releases = sorted(new_releases + self.releases, key=Chapter.sort_key, reverse=True)
+        return self
+
     def __repr__(self) -> str:
         rep = f"Available releases for serie {self.serie_id}:"
         releases = '\n'.join(f"{release} \tby group {release.group}" for release in self.releases)
         if releases:
             rep += '\n' + releases
         return rep
+
+
+class ReleaseCursor(Serializable):
+    """ high-water mark of the release feed: ids of the records already processed per release date """
+    def __init__(self, seen_record_ids: Union[Dict[str, Iterable[int]], None] = None):
+        # release dates are kept as iso strings, as they are written in the feed
+        self.seen_record_ids: Dict[str, Set[int]] = {release_date: set(record_ids)
+                                                      for release_date, record_ids in (seen_record_ids or {}).items()}
+
+    @property
+    def release_date(self) -> Union[date, None]:
+        """ newest release date processed """
+        if not self.seen_record_ids:
+            return None
+        return date.fromisoformat(max(self.seen_record_ids))
+
+    def until(self, overlap_days: int, default: date) -> date:
+        """ oldest release date to request, going back overlap_days to catch late indexed releases """
+        if self.release_date is None:
+            return default
+        return self.release_date - timedelta(days=overlap_days)
+
+    def is_processed(self, release_date: str, record_id: Union[int, None]) -> bool:
+        return record_id in self.seen_record_ids.get(release_date, ())
+
+    def add(self, release_date: str, record_id: Union[int, None]) -> None:
+        if record_id is not None:
+            self.seen_record_ids.setdefault(release_date, set()).add(record_id)
+
+    def prune(self, overlap_days: int) -> 'ReleaseCursor':
+        """ forgets the records that are older than the overlap """
+        if self.release_date is not None:
+            keep_from = (self.release_date - timedelta(days=overlap_days)).isoformat()
+            self.seen_record_ids = {release_date: record_ids
+                                    for release_date, record_ids in self.seen_record_ids.items()
+                                    if release_date >= keep_from}
+        return self
+
+    def __repr__(self) -> str:
+        return f"Release cursor at {self.release_date} " \
+               f"({sum(len(ids) for ids in self.seen_record_ids.values())} records seen)"
+
+    def serialize(self) -> Dict[str, Any]:
+        return dict(seen_record_ids={release_date: sorted(record_ids)
+                                     for release_date, record_ids in self.seen_record_ids.items()})
+
+    @classmethod
+    def deserialize(cls, dict_data: Dict[str, Any]) -> 'ReleaseCursor':
+        return cls({release_date: [int(record_id) for record_id in record_ids]
+                    for release_date, record_ids in dict_data.get('seen_record_ids', {}).items()})
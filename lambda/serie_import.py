@@ -0,0 +1,130 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import io
+from typing import List, Tuple, Dict, TextIO
+
+import click
+from PIL import Image
+
+import mangaupdate_srv
+import page_marks_db
+from config import SERIE_IMPORT_CONCURRENCY
+from img_hosting import expose_image
+from lookup_cache import lookup_cache, search_series, get_serie_info, get_image
+from releases_types import Serie
+
+PICK_POLICIES = ('exact', 'first')
+
+
+def read_entries(file: TextIO) -> List[str]:
+    """ series ids or names, one per line. blank lines and lines starting with # are ignored """
+    entries = [line.strip() for line in file]
+    return [entry for entry in entries if entry and not entry.startswith('#')]
+
+
+def resolve_serie(entry: str, pick: str) -> Serie:
+    """ the serie of an id, or the search result of a name picked according to the policy """
+    if entry.isdigit():
+        return get_serie_info(int(entry))
+    series = search_series(entry)
+    if not series:
+        raise LookupError('no serie found')
+    if pick == 'first':
+        return series[0]
+    exact_matches = [serie for serie in series if serie.serie_name.casefold() == entry.casefold()]
+    if len(exact_matches) != 1:
+        raise LookupError(f'{len(exact_matches)} series named exactly so out of {len(series)} results')
+    return exact_matches[0]
+
+
+def host_cover(serie: Serie) -> bool:
+    """ hosts the cover of the serie, returns whether it was uploaded """
+    image = Image.open(io.BytesIO(get_image(serie.img_url)))
+    return expose_image(serie_id=serie.serie_id, image=image)
+
+
+@click.command()
+@click.argument('file', type=click.File('r'))
+@click.option('--pick', type=click.Choice(PICK_POLICIES), default='exact',
+              help='For names: keep the only result with that exact name, or the first result of the search.')
+@click.option('--history-days', default=0,
+              help='Number of days of releases added as already published chapters of the new series.')
+@click.option('--keep_chapters/--delete_chapters', default=True, help='Whether to keep the chapters already present in db.')
+@click.option('--concurrency', default=SERIE_IMPORT_CONCURRENCY, help='Number of series imported in parallel.')
+@click.option('--cache/--no-cache', default=True, help='Whether to reuse the searches, series and images looked up recently.')
+def import_series(file: TextIO, pick: str, history_days: int, keep_chapters: bool, concurrency: int, cache: bool):
+    """
+    called only in local for admin tasks: adds in db the series listed in file, by id or by name, without prompts.
+    the covers of the series already in db are left as is, unless their chapters are deleted.
+    page marks are written at once after all the series were resolved and their covers hosted.
+    """
+    lookup_cache.bypass = not cache
+    entries = list(dict.fromkeys(read_entries(file)))
+    imported_series: Dict[str, Serie] = dict()
+    serie_entries: Dict[str, str] = dict()
+    failures: List[Tuple[str, str]] = []
+    outcomes = Counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # the release history is read while the series are resolved
+        releases_future = None
+        if history_days:
+            releases_future = executor.submit(
+                mangaupdate_srv.get_releases, datetime.date.today() - datetime.timedelta(days=history_days))
+        futures = {executor.submit(resolve_serie, entry, pick): entry for entry in entries}
+        with click.progressbar(as_completed(futures), length=len(futures), label='Resolving series') as bar:
+            for future in bar:
+                try:
+                    serie = future.result()
+                except Exception as e:
+                    failures.append((futures[future], str(e)))
+                    continue
+                if serie.serie_id in imported_series:
+                    outcomes['duplicates'] += 1
+                    continue
+                imported_series[serie.serie_id] = serie
+                serie_entries[serie.serie_id] = futures[future]
+
+        stored_serie_ids = set()
+        if keep_chapters:
+            stored_serie_ids = {page_mark.serie_id for page_mark in page_marks_db.get_many(imported_series)}
+        if stored_serie_ids:
+            # left as is with their cover and chapters, archived ones included
+            outcomes['already in db'] = len(stored_serie_ids)
+        new_series = [serie for serie_id, serie in imported_series.items() if serie_id not in stored_serie_ids]
+        hosted_series: List[Serie] = []
+        futures = {executor.submit(host_cover, serie): serie for serie in new_series}
+        with click.progressbar(as_completed(futures), length=len(futures), label='Hosting covers') as bar:
+            for future in bar:
+                serie = futures[future]
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    failures.append((serie_entries[serie.serie_id], str(e)))
+                    continue
+                hosted_series.append(serie)
+                outcomes['covers uploaded' if uploaded else 'covers unchanged'] += 1
+        released_chapters = dict()
+        if releases_future is not None:
+            released_chapters = {serie_releases.serie_id: serie_releases.releases
+                                 for serie_releases in releases_future.result()}
+
+    page_marks = []
+    for serie in hosted_series:
+        chapter_marks = released_chapters.get(serie.serie_id, [])
+        if chapter_marks:
+            outcomes['seeded chapters'] += len(chapter_marks)
+        page_marks.append(page_marks_db.PageMark(serie_id=serie.serie_id,
+                                                 serie_name=serie.serie_name,
+                                                 chapter_marks=chapter_marks))
+    page_marks_db.batch_put(page_marks)
+
+    click.echo(f"{len(page_marks)} series stored out of {len(entries)} entries"
+               + ''.join(f", {outcome} {number}" for outcome, number in outcomes.items()))
+    for entry, reason in failures:
+        click.echo(f"Failed {entry}: {reason}")
+
+
+if __name__ == "__main__":
+    ## called only in local for admin tasks
+    import_series()
@@ -7,20 +7,24 @@ from PIL import Image
 
 import mangaupdate_srv
 import page_marks_db
+from lookup_cache import lookup_cache, search_series, get_image
 from releases_types import Serie
 from img_hosting import expose_image
 
 
 @click.command()
 @click.option('--keep_chapters/--delete_chapters', default=True, help='Whether to keep the chapters already present in db.')
-def add_serie_in_db(keep_chapters=True):
+@click.option('--cache/--no-cache', default=True,
+              help='Whether to reuse the searches, series and images looked up recently instead of requesting them.')
+def add_serie_in_db(keep_chapters=True, cache=True):
     """ called only in local for admin tasks """
+    lookup_cache.bypass = not cache
     serie_id: str = None
     selected_serie: Serie = None
     image: Image = None
     while True:
         search = click.prompt("Search keywords ", type=str)
-        series = mangaupdate_srv.search_series(search)
+        series = search_series(search)
         series = {s.serie_id: s for s in series}
         question_key = "serie_id"
         answers = inquirer.prompt([
@@ -37,7 +41,7 @@ def add_serie_in_db(keep_chapters=True):
             continue
         serie_id = answers[question_key]
         selected_serie = series[serie_id]
-        image = Image.open(io.BytesIO(mangaupdate_srv.get_image(selected_serie.img_url)))
+        image = Image.open(io.BytesIO(get_image(selected_serie.img_url)))
         image.show(title=selected_serie.serie_name)
         if click.confirm("Does the image correspond ?"):
             break
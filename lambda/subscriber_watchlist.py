@@ -0,0 +1,56 @@
+from typing import Tuple
+
+import click
+
+import page_marks_db
+
+
+@click.group()
+def watchlist():
+    """ called only in local for admin tasks: series watched by each subscriber of the newsletter """
+
+
+@watchlist.command()
+@click.argument('email')
+@click.argument('serie_ids', nargs=-1)
+def add(email: str, serie_ids: Tuple[str, ...]):
+    """ subscribes the email if needed and adds the series to its watchlist """
+    subscriber = page_marks_db.get_subscriber(email) or page_marks_db.Subscriber(email)
+    known_ids = {page_mark.serie_id for page_mark in page_marks_db.get_many(serie_ids)}
+    unknown_ids = [serie_id for serie_id in serie_ids if serie_id not in known_ids]
+    if unknown_ids:
+        click.echo(f"Series {', '.join(unknown_ids)} are not watched, add them with serie_watcher first.")
+    subscriber.serie_ids.update(known_ids)
+    page_marks_db.put_subscriber(subscriber)
+    click.echo(repr(subscriber))
+
+
+@watchlist.command()
+@click.argument('email')
+@click.argument('serie_ids', nargs=-1)
+def remove(email: str, serie_ids: Tuple[str, ...]):
+    """ removes the series from the watchlist, or unsubscribes the email when no serie is given """
+    subscriber = page_marks_db.get_subscriber(email)
+    if subscriber is None:
+        click.echo(f"{email} is not subscribed. Stopping here.")
+        return
+    if not serie_ids:
+        click.confirm(f"Do you want to unsubscribe {email} ?", abort=True)
+        page_marks_db.delete_subscriber(email)
+        click.echo("Done")
+        return
+    subscriber.serie_ids.difference_update(serie_ids)
+    page_marks_db.put_subscriber(subscriber)
+    click.echo(repr(subscriber))
+
+
+@watchlist.command(name='list')
+def list_subscribers():
+    """ prints the subscribers with the series they watch """
+    for subscriber in page_marks_db.get_subscribers():
+        click.echo(f"{repr(subscriber)}: {', '.join(sorted(subscriber.serie_ids))}")
+
+
+if __name__ == "__main__":
+    ## called only in local for admin tasks
+    watchlist()